@@ -0,0 +1,65 @@
+"""
+Times configuration loading for synthetic tunnels, on a cache miss, on a
+cache hit and when already loaded by the process. Run from the repository root:
+
+  python -m benchmarks.config [peers ...]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from base64 import b64encode
+
+def synthetic_config(peers):
+  lines = [
+    'description: benchmark tunnel',
+    'interface:',
+    '  address: 10.0.0.1/8',
+    '  listen_port: 42000',
+    '  private_key: /etc/wireguard/bench.key',
+    'peers:'
+  ]
+
+  for i in range(peers):
+    lines += [
+      '  - description: peer {}'.format(i),
+      '    public_key: {}'.format(b64encode(i.to_bytes(32, 'big')).decode()),
+      '    persistent_keepalive_interval: 25',
+      '    allowed_ips:',
+      '      - 10.{}.{}.{}/32'.format(i >> 16 & 0xff, i >> 8 & 0xff, i & 0xff)
+    ]
+
+  return '\n'.join(lines) + '\n'
+
+def measure(function, *args):
+  start = time.perf_counter()
+  function(*args)
+
+  return time.perf_counter() - start
+
+def run(peers):
+  from wgctl.util import config
+
+  with tempfile.TemporaryDirectory() as root:
+    config.CACHE_DIR = os.path.join(root, 'cache')
+    config_path = os.path.join(root, 'bench.yml')
+
+    with open(config_path, 'w') as stream:
+      stream.write(synthetic_config(peers))
+
+    miss = measure(config.load_config, config_path)
+    config._loaded.clear()
+    hit = measure(config.load_config, config_path)
+    memory = measure(config.load_config, config_path)
+
+  return {'peers': peers, 'loader': config.Loader.__name__, 'miss': miss, 'hit': hit, 'memory': memory}
+
+def main(argv):
+  for peers in [int(arg) for arg in argv] or [1, 100, 10000]:
+    result = run(peers)
+    print('config load, {peers} peers ({loader}): miss {miss:.4f}s, hit {hit:.4f}s, in memory {memory:.4f}s'.format(**result))
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
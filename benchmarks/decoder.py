@@ -0,0 +1,82 @@
+"""
+Compares decoding a GET_DEVICE dump through pyroute2 (iter_peers) with
+reading it in place (iter_peer_views, which get_device_dict uses), for
+synthetic tunnels replayed from an in-memory netlink socket. The views are
+checked to decode to the same peers, then timed when only counters are read
+(as metrics and watch do) and when every peer is fully materialized, and
+against a columnar Snapshot. Replies left over from an earlier dump are
+checked to be ignored. Run from the repository root:
+
+  python -m benchmarks.decoder [--peers N ...]
+"""
+
+import argparse
+import random
+import struct
+import sys
+
+from benchmarks.fake import FakeWireGuard, capture_dump, FAKE_SEQ
+from benchmarks.suite import measure
+from benchmarks.encoder import random_tunnel
+from wgctl.util.snapshot import Snapshot
+
+def counters(wg):
+  return sum(peer.rx_bytes + peer.tx_bytes + peer.last_handshake for peer in wg.iter_peer_views(ifname='wg0'))
+
+def snapshot(wg):
+  return Snapshot.capture(wg, 'wg0')
+
+def materialize(wg):
+  return [peer.to_dict() for peer in wg.iter_peer_views(ifname='wg0')]
+
+def with_stale_replies(buffers):
+  """
+  Returns the given receive buffers with the first message of the dump, as
+  answered to another sequence number, prepended to each of them
+  """
+
+  stale = bytearray(buffers[0])
+  struct.pack_into('I', stale, 8, FAKE_SEQ + 1)
+
+  return [bytes(stale) + data for data in buffers]
+
+def main(argv):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks.decoder')
+  parser.add_argument('--peers', type=int, nargs='+', default=[10000, 50000])
+  args = parser.parse_args(argv)
+
+  rng = random.Random(0)
+  mismatches = 0
+
+  for peers in args.peers:
+    tunnel = random_tunnel(rng, peers)
+    wg = FakeWireGuard(capture_dump('wg0', tunnel, bytes(32)))
+
+    expected = list(wg.iter_peers(ifname='wg0'))
+    if materialize(wg) != expected:
+      print('{} peers: views decode differently from pyroute2'.format(peers), file=sys.stderr)
+      mismatches += 1
+
+    stale = FakeWireGuard(with_stale_replies(wg.replies))
+    if materialize(stale) != expected or snapshot(stale).keys != snapshot(wg).keys:
+      print('{} peers: replies to another request are decoded'.format(peers), file=sys.stderr)
+      mismatches += 1
+
+    for name, function in [
+      ('pyroute2', lambda: list(wg.iter_peers(ifname='wg0'))),
+      ('views, counters', lambda: counters(wg)),
+      ('views, to_dict', lambda: materialize(wg)),
+      ('snapshot', lambda: snapshot(wg))
+    ]:
+      elapsed, peak = measure(function)
+      print('{:>7} peers  {:<16} {:8.4f}s {:>12} B peak'.format(peers, name, elapsed, peak))
+
+    columns = snapshot(wg)
+    total = columns.total()
+    elapsed, peak = measure(lambda: columns.top(total, 20))
+    print('{:>7} peers  {:<16} {:8.4f}s {:>12} B peak'.format(peers, 'snapshot, top 20', elapsed, peak))
+
+  return 1 if mismatches > 0 else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,121 @@
+"""
+Checks that SetDeviceEncoder produces the same bytes as the pyroute2 encoder
+for randomly generated tunnels mixing IPv4 and IPv6 endpoints and allowed
+IPs, pre-shared keys, keepalives, peer flags and peers split over several
+messages, then times both on bulk applies. Exits with status 1 if any
+message differs. Run from the repository root:
+
+  python -m benchmarks.encoder [--seed N] [--peers N ...]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from base64 import b64encode
+from benchmarks.fake import FakeWireGuard
+from wgctl.util.model import Tunnel, Interface, Peer
+from wgctl.util.netlink import WGPEER_F_REPLACE_ALLOWEDIPS
+
+PRIVATE_KEY = b64encode(bytes(range(32))).decode()
+
+def random_net(rng):
+  if rng.random() < 0.5:
+    return '10.{}.{}.0/{}'.format(rng.randrange(256), rng.randrange(256), rng.choice([24, 32]))
+
+  return 'fd00:{:x}:{:x}::/{}'.format(rng.randrange(65536), rng.randrange(65536), rng.choice([48, 64, 128]))
+
+def random_endpoint(rng):
+  choice = rng.random()
+
+  if choice < 0.3:
+    return None
+  elif choice < 0.65:
+    return '192.0.2.{}:{}'.format(rng.randrange(256), rng.randrange(1, 65536))
+
+  return '[2001:db8::{:x}]:{}'.format(rng.randrange(65536), rng.randrange(1, 65536))
+
+def random_peer(rng, index):
+  return Peer(
+    None, index.to_bytes(32, 'big'),
+    preshared_key=bytes(rng.randrange(256) for _ in range(32)) if rng.random() < 0.3 else None,
+    endpoint=random_endpoint(rng),
+    persistent_keepalive_interval=rng.choice([None, 0, 25]),
+    # A few peers carry more allowed IPs than fit in one message
+    allowed_ips=[random_net(rng) for _ in range(rng.choice([0, 1, 2, 8]) if rng.random() < 0.99 else 400)]
+  )
+
+def random_tunnel(rng, peers):
+  interface = Interface('/dev/null', rng.randrange(1, 65536), fwmark=rng.choice([None, 0, 51820]))
+
+  return Tunnel(interface, [random_peer(rng, index) for index in range(peers)])
+
+def apply(tunnel, fast):
+  wg = FakeWireGuard()
+  wg.set_device(ifname='wg0', config=tunnel, private_key=PRIVATE_KEY, fast=fast)
+  wg.set_peers(ifname='wg0', peers=tunnel.peers, remove=[peer.key for peer in tunnel.peers[:10]], fast=fast)
+
+  return wg.sent
+
+def check(rng, rounds):
+  """
+  Returns the number of messages that differ between the two encoders
+  """
+
+  mismatches = 0
+
+  for _ in range(rounds):
+    tunnel = random_tunnel(rng, rng.choice([0, 1, 5, 50, 300]))
+    expected, actual = apply(tunnel, False), apply(tunnel, True)
+
+    if len(expected) != len(actual):
+      print('message count differs: {} != {}'.format(len(expected), len(actual)), file=sys.stderr)
+      mismatches += 1
+      continue
+
+    for index, (left, right) in enumerate(zip(expected, actual)):
+      if left != right:
+        print('message {} differs at byte {}'.format(index, first_difference(left, right)), file=sys.stderr)
+        mismatches += 1
+
+  return mismatches
+
+def first_difference(left, right):
+  for offset, (a, b) in enumerate(zip(left, right)):
+    if a != b:
+      return offset
+
+  return min(len(left), len(right))
+
+def measure(tunnel, fast):
+  wg = FakeWireGuard()
+
+  start = time.perf_counter()
+  wg.set_device(ifname='wg0', config=tunnel, private_key=PRIVATE_KEY, fast=fast)
+
+  return time.perf_counter() - start, len(wg.sent)
+
+def main(argv):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks.encoder')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--rounds', type=int, default=200)
+  parser.add_argument('--peers', type=int, nargs='+', default=[100, 10000])
+  args = parser.parse_args(argv)
+
+  rng = random.Random(args.seed)
+
+  mismatches = check(rng, args.rounds)
+  print('{} rounds, {} mismatching messages'.format(args.rounds, mismatches))
+
+  for peers in args.peers:
+    tunnel = random_tunnel(rng, peers)
+    slow, messages = measure(tunnel, False)
+    fast, _ = measure(tunnel, True)
+
+    print('{:>7} peers, {:>5} messages: pyroute2 {:.4f}s, fast {:.4f}s (x{:.1f})'.format(peers, messages, slow, fast, slow / fast))
+
+  return 1 if mismatches > 0 else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,138 @@
+"""
+In-memory stand-in for the WireGuard generic netlink socket, so that message
+encoding and dump decoding can be measured without root or a kernel module.
+"""
+
+import struct
+
+from pyroute2.netlink import NLM_F_MULTI, NLMSG_DONE
+from pyroute2.netlink.nlsocket import Marshal
+from wgctl.util.netlink import WireGuard, wgmsg, encode_peer, peer_size, allowedip_size, nla_size
+from wgctl.util.netlink import WG_CMD_GET_DEVICE, WG_GENL_VERSION, WG_MSG_MAX_SIZE, WG_KEY_LEN, NLMSG_HDRLEN, GENL_HDRLEN, NLA_HDRLEN
+
+# Generic netlink family id and dump sequence number used by the fake socket
+FAKE_PRID = 0x20
+FAKE_SEQ = 0x100
+
+class Pool(object):
+  def alloc(self):
+    return FAKE_SEQ
+
+  def free(self, *args, **kwargs):
+    pass
+
+class FakeWireGuard(WireGuard):
+  """
+  Records the encoded bytes of every message sent through it in sent, and
+  answers dump requests by replaying the given receive buffers.
+  """
+
+  def __init__(self, replies=[]):
+    self.prid = FAKE_PRID
+    self.marshal = Marshal()
+    self.marshal.msg_map[FAKE_PRID] = wgmsg
+    self.addr_pool = Pool()
+    self.replies = list(replies)
+    self.pending = iter(())
+    self.sent = []
+
+  def record(self, msg, msg_type, msg_flags, msg_seq=0):
+    msg['header']['type'] = msg_type
+    msg['header']['flags'] = msg_flags
+    msg['header']['sequence_number'] = msg_seq
+    msg['header']['pid'] = 0
+    msg.encode()
+
+    self.sent.append(bytes(msg.data))
+
+  def put(self, msg, msg_type, msg_flags=0, msg_seq=0, **kwargs):
+    self.record(msg, msg_type, msg_flags, msg_seq)
+    self.pending = iter(self.replies)
+
+  def nlm_request(self, msg, msg_type, msg_flags=0, **kwargs):
+    self.record(msg, msg_type, msg_flags)
+
+    return ()
+
+  def raw_request(self, data):
+    self.sent.append(bytes(data))
+
+    return ()
+
+  def recv(self, bufsize):
+    return next(self.pending)
+
+  def close(self):
+    pass
+
+def capture_dump(ifname, config, private_key, rx=1 << 20, tx=1 << 16, handshake=1600000000):
+  """
+  Returns the receive buffers the kernel would answer a GET_DEVICE dump of
+  the given tunnel with: the peers spread over messages of at most
+  WG_MSG_MAX_SIZE bytes, with the same traffic counters and handshake time,
+  followed by NLMSG_DONE.
+  """
+
+  buffers, peers = [], []
+  header = NLMSG_HDRLEN + GENL_HDRLEN + nla_size(len(ifname) + 1) + 2 * nla_size(WG_KEY_LEN) + 3 * nla_size(4) + NLA_HDRLEN
+  size = header
+
+  for peer in config.peers:
+    need = reply_peer_size(peer)
+
+    if len(peers) > 0 and size + need > WG_MSG_MAX_SIZE:
+      buffers.append(reply(ifname, config, private_key, peers, first=len(buffers) == 0))
+      peers, size = [], header
+
+    nest = encode_peer(peer.replace(
+      preshared_key=peer.preshared_key or bytes(WG_KEY_LEN),
+      persistent_keepalive_interval=peer.persistent_keepalive_interval or 0
+    ))
+    nest['attrs'].append(['WGPEER_A_LAST_HANDSHAKE_TIME', struct.pack('ll', handshake, 0)])
+    nest['attrs'].append(['WGPEER_A_RX_BYTES', rx])
+    nest['attrs'].append(['WGPEER_A_TX_BYTES', tx])
+
+    peers.append(nest)
+    size += need
+
+  buffers.append(reply(ifname, config, private_key, peers, first=len(buffers) == 0))
+  buffers.append(struct.pack('IHHIIi', NLMSG_HDRLEN + 4, NLMSG_DONE, NLM_F_MULTI, FAKE_SEQ, 0, 0))
+
+  return buffers
+
+def reply(ifname, config, private_key, peers, first=True):
+  msg = wgmsg()
+  msg['cmd'] = WG_CMD_GET_DEVICE
+  msg['version'] = WG_GENL_VERSION
+  msg['header']['type'] = FAKE_PRID
+  msg['header']['flags'] = NLM_F_MULTI
+  msg['header']['sequence_number'] = FAKE_SEQ
+  msg['header']['pid'] = 0
+
+  msg['attrs'].append(['WGDEVICE_A_IFINDEX', 1])
+  msg['attrs'].append(['WGDEVICE_A_IFNAME', ifname])
+
+  if first:
+    msg['attrs'].append(['WGDEVICE_A_PRIVATE_KEY', private_key])
+    msg['attrs'].append(['WGDEVICE_A_PUBLIC_KEY', bytes(WG_KEY_LEN)])
+    msg['attrs'].append(['WGDEVICE_A_LISTEN_PORT', config.interface.listen_port])
+    msg['attrs'].append(['WGDEVICE_A_FWMARK', config.interface.fwmark or 0])
+
+  msg['attrs'].append(['WGDEVICE_A_PEERS', peers])
+  msg.encode()
+
+  return bytes(msg.data)
+
+def reply_peer_size(peer):
+  """
+  Encoded size of a peer as the kernel dumps it, which always includes the
+  preshared key, keepalive interval, handshake time and traffic counters
+  """
+
+  size = peer_size(peer.replace(preshared_key=bytes(WG_KEY_LEN), persistent_keepalive_interval=0))
+  size += nla_size(16) + 2 * nla_size(8)
+
+  if len(peer.allowed_ips) > 0:
+    size += NLA_HDRLEN + sum(allowedip_size(net) for net in peer.allowed_ips)
+
+  return size
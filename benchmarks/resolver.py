@@ -0,0 +1,131 @@
+"""
+Checks and times endpoint resolution against a local stub DNS server, which
+answers every peer<N>.test name with an A record after a fixed delay: names
+from a hosts file are not queried, all others are resolved concurrently, a
+second pass is answered from the persistent cache, and a pass after the
+TTL expired queries again. Exits with status 1 if any answer is wrong. Run
+from the repository root:
+
+  python -m benchmarks.resolver [--hosts N] [--delay MS] [--jobs N]
+"""
+
+import argparse
+import os
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from socket import inet_aton
+from wgctl.util.model import Tunnel, Interface, Peer
+from wgctl.util.network import pack_endpoint
+from wgctl.util.resolver import Resolver, DNS_HEADER, resolve_endpoints
+
+TTL = 60
+
+def address(index):
+  return '10.{}.{}.{}'.format(index >> 16 & 0xff, index >> 8 & 0xff, index & 0xff)
+
+class StubHandler(socketserver.BaseRequestHandler):
+  def handle(self):
+    data, sock = self.request
+    ident, _, _, _, _, _ = DNS_HEADER.unpack_from(data)
+
+    offset, labels = DNS_HEADER.size, []
+    while data[offset] > 0:
+      labels.append(data[offset + 1:offset + 1 + data[offset]].decode())
+      offset += data[offset] + 1
+    qtype, = struct.unpack_from('!H', data, offset + 1)
+    question = data[DNS_HEADER.size:offset + 5]
+
+    name = '.'.join(labels)
+    time.sleep(self.server.delay)
+    self.server.queries += 1
+
+    if not name.startswith('peer') or not name.endswith('.test'):
+      reply = DNS_HEADER.pack(ident, 0x8183, 1, 0, 0, 0) + question
+    elif qtype != 1:
+      reply = DNS_HEADER.pack(ident, 0x8180, 1, 0, 0, 0) + question
+    else:
+      record = struct.pack('!HHHIH', 0xc00c, 1, 1, TTL, 4) + inet_aton(address(int(name[4:-5])))
+      reply = DNS_HEADER.pack(ident, 0x8180, 1, 1, 0, 0) + question + record
+
+    sock.sendto(reply, self.client_address)
+
+class StubServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+  daemon_threads = True
+
+  def __init__(self, delay):
+    socketserver.UDPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+    self.delay = delay
+    self.queries = 0
+
+def check(label, answers, failures, hosts):
+  wrong = [host for host in hosts if answers.get(host, (None, None))[1] != address(int(host[4:-5]))]
+
+  if len(failures) > 0 or len(wrong) > 0:
+    print('{}: {} failures, {} wrong answers'.format(label, len(failures), len(wrong)), file=sys.stderr)
+    return False
+
+  return True
+
+def main(argv):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks.resolver')
+  parser.add_argument('--hosts', type=int, default=1000)
+  parser.add_argument('--delay', type=float, default=20, help='stub server delay per query, in milliseconds')
+  parser.add_argument('--jobs', type=int, default=32)
+  args = parser.parse_args(argv)
+
+  server = StubServer(args.delay / 1000)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  nameserver = '127.0.0.1:{}'.format(server.server_address[1])
+
+  hosts = ['peer{}.test'.format(index) for index in range(args.hosts)]
+  ok = True
+
+  with tempfile.TemporaryDirectory() as root:
+    hosts_path = os.path.join(root, 'hosts')
+    with open(hosts_path, 'w') as stream:
+      stream.write('{} peer0.test\n'.format(address(0)))
+
+    cache_path = os.path.join(root, 'endpoints.cache')
+
+    def run(label, now=None):
+      nonlocal ok
+
+      resolver = Resolver(cache_path=cache_path, hosts_path=hosts_path, nameserver=nameserver, jobs=args.jobs)
+      before = server.queries
+      start = time.perf_counter()
+      answers, failures = resolver.resolve(hosts, now=now)
+      elapsed = time.perf_counter() - start
+
+      ok = check(label, answers, failures, hosts) and ok
+      print('{:<12} {:>6} hosts {:10.4f}s {:>6} queries'.format(label, len(hosts), elapsed, server.queries - before), file=sys.stderr)
+
+    run('cold')
+    run('cached')
+    run('expired', now=time.time() + TTL + 1)
+
+    resolver = Resolver(hosts_path=hosts_path, nameserver=nameserver, jobs=args.jobs)
+    peers = [Peer(None, bytes(32), endpoint='{}:51820'.format(host)) for host in hosts[:10]]
+    peers.append(Peer(None, bytes(32), endpoint='[fd00::1]:51820'))
+
+    tunnel = resolve_endpoints(Tunnel(Interface(None, 1), peers), resolver)
+    endpoints = [peer.endpoint for peer in tunnel.peers]
+
+    if endpoints != ['{}:51820'.format(address(index)) for index in range(10)] + ['[fd00::1]:51820']:
+      print('resolve_endpoints: unexpected endpoints {}'.format(endpoints), file=sys.stderr)
+      ok = False
+
+    for endpoint in endpoints:
+      pack_endpoint(endpoint)
+
+  server.shutdown()
+
+  if not ok:
+    sys.exit(1)
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,78 @@
+"""
+Measures the cold start of every wgctl subcommand, by running it with --help
+(which loads the command and everything it imports, but does not touch the
+system) in a fresh interpreter. Exits with status 1 if any of them is over
+its budget. Run from the repository root, as root:
+
+  python -m benchmarks.startup [--runs N]
+"""
+
+import sys
+import time
+import subprocess
+
+# Budgets in milliseconds, including the interpreter's own start-up
+BUDGETS = {
+  'version': 100,
+  'serve': 100,
+  'status': 350,
+  'info': 350,
+  'start': 350,
+  'stop': 350,
+  'restart': 350,
+  'sync': 350,
+  'metrics': 350,
+  'watch': 350,
+  'top': 350,
+  'lookup': 350,
+  'peers': 350
+}
+
+def cold_start(command, runs):
+  argv = [sys.executable, '-c', 'from wgctl.main import main; main()', command]
+  if command != 'version':
+    argv.append('--help')
+
+  return fastest(argv, runs)
+
+def fastest(argv, runs):
+  """
+  Returns the fastest wall time of runs executions of argv, in milliseconds
+  """
+
+  best = None
+
+  for _ in range(runs):
+    start = time.perf_counter()
+    subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if best is None or elapsed < best:
+      best = elapsed
+
+  return best
+
+def main(argv):
+  runs = 5
+  if len(argv) == 2 and argv[0] == '--runs':
+    runs = int(argv[1])
+
+  baseline = fastest([sys.executable, '-c', 'pass'], runs)
+  over = 0
+
+  print('python start-up: {:.1f}ms'.format(baseline))
+
+  for command, budget in sorted(BUDGETS.items()):
+    elapsed = cold_start(command, runs)
+    status = 'ok'
+
+    if elapsed > budget:
+      status = 'OVER BUDGET'
+      over += 1
+
+    print('{:<8} {:7.1f}ms (budget {}ms) {}'.format(command, elapsed, budget, status))
+
+  return 1 if over > 0 else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,179 @@
+"""
+Measures configuration loading, SET_DEVICE encoding, dump decoding and the
+info command (as text and NDJSON) and the metrics exposition against an in-memory netlink socket, for synthetic tunnels of
+increasing size. Every stage is run once for its wall time and once under
+tracemalloc for its peak memory. Results are written as JSON, and can be
+compared with those of a previous run. Run from the repository root:
+
+  python -m benchmarks.suite [--peers N ...] [--output FILE] [--baseline FILE]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from base64 import b64encode
+from contextlib import redirect_stdout
+from benchmarks.config import synthetic_config
+from benchmarks.fake import FakeWireGuard, capture_dump
+
+PEERS = [1, 100, 10000, 100000]
+
+PRIVATE_KEY = bytes(range(32))
+
+def measure(function):
+  """
+  Returns the wall time of function, and its peak memory allocation in a
+  second run under tracemalloc
+  """
+
+  start = time.perf_counter()
+  function()
+  elapsed = time.perf_counter() - start
+
+  tracemalloc.start()
+  try:
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+
+  return elapsed, peak
+
+def run(peers, root):
+  from wgctl.util import config, netlink
+  from wgctl.commands.status import info
+  from wgctl.commands.metrics import render
+
+  config_path = os.path.join(root, 'bench{}.yml'.format(peers))
+  with open(config_path, 'w') as stream:
+    stream.write(synthetic_config(peers))
+
+  def config_miss():
+    config._loaded.clear()
+    for name in os.listdir(config.CACHE_DIR):
+      os.unlink(os.path.join(config.CACHE_DIR, name))
+
+    config.get_config(config_path)
+
+  def config_hit():
+    config._loaded.clear()
+    config.get_config(config_path)
+
+  instance, tunnel = config.get_config(config_path)
+  wg = FakeWireGuard(capture_dump(instance, tunnel, PRIVATE_KEY))
+  netlink._sockets.wg = wg
+
+  def set_device():
+    wg.sent.clear()
+    wg.set_device(ifname=instance, config=tunnel, private_key=b64encode(PRIVATE_KEY).decode())
+
+  def get_device_dict():
+    wg.get_device_dict(ifname=instance)
+
+  def iter_peer_views():
+    for peer in wg.iter_peer_views(ifname=instance):
+      peer.rx_bytes, peer.tx_bytes, peer.last_handshake
+
+  # Output goes to /dev/null, so that it does not count towards peak memory
+  def show_info(*args):
+    with open(os.devnull, 'w') as null, redirect_stdout(null):
+      info.main(args=[config_path, *args], standalone_mode=False, obj={'verbose': False})
+
+  stages = [
+    ('config_miss', config_miss),
+    ('config_hit', config_hit),
+    ('set_device', set_device),
+    ('get_device_dict', get_device_dict),
+    ('iter_peer_views', iter_peer_views),
+    ('info', show_info),
+    ('info_ndjson', lambda: show_info('--format', 'ndjson')),
+    ('metrics', lambda: render([config_path]))
+  ]
+
+  results = []
+
+  for stage, function in stages:
+    elapsed, peak = measure(function)
+    result = {'stage': stage, 'peers': peers, 'seconds': round(elapsed, 6), 'peak_bytes': peak}
+
+    if stage == 'set_device':
+      result['messages'] = len(wg.sent)
+      result['bytes'] = sum(len(data) for data in wg.sent)
+    elif stage in ('get_device_dict', 'iter_peer_views'):
+      result['messages'] = len(wg.replies)
+      result['bytes'] = sum(len(data) for data in wg.replies)
+
+    results.append(result)
+    print('{stage:<16} {peers:>7} peers {seconds:10.4f}s {peak_bytes:>12} B peak'.format(**result), file=sys.stderr)
+
+  netlink._sockets.wg = None
+
+  return results
+
+def compare(results, baseline):
+  """
+  Prints the time and memory ratio of every stage to the same stage in a
+  previous run
+  """
+
+  previous = {(result['stage'], result['peers']): result for result in baseline['results']}
+
+  for result in results:
+    before = previous.get((result['stage'], result['peers']))
+    if before is None or before['seconds'] == 0 or before['peak_bytes'] == 0:
+      continue
+
+    print('{:<16} {:>7} peers  time x{:.2f}  memory x{:.2f}'.format(
+      result['stage'], result['peers'],
+      result['seconds'] / before['seconds'], result['peak_bytes'] / before['peak_bytes']), file=sys.stderr)
+
+def main(argv):
+  parser = argparse.ArgumentParser(prog='python -m benchmarks.suite')
+  parser.add_argument('--peers', type=int, nargs='+', default=PEERS)
+  parser.add_argument('--output', help='write the results to this file instead of stdout')
+  parser.add_argument('--baseline', help='compare with the results of a previous run')
+  args = parser.parse_args(argv)
+
+  from wgctl.util import config
+
+  results = []
+
+  with tempfile.TemporaryDirectory() as root:
+    config.CACHE_DIR = os.path.join(root, 'cache')
+    os.makedirs(config.CACHE_DIR)
+
+    for peers in args.peers:
+      results += run(peers, root)
+
+  try:
+    from importlib.metadata import version
+    wgctl_version = version('wgctl')
+  except Exception:
+    wgctl_version = 'unknown'
+
+  report = {
+    'wgctl': wgctl_version,
+    'python': platform.python_version(),
+    'loader': config.Loader.__name__,
+    'results': results
+  }
+
+  if args.baseline is not None:
+    with open(args.baseline) as stream:
+      compare(results, json.load(stream))
+
+  if args.output is not None:
+    with open(args.output, 'w') as stream:
+      json.dump(report, stream, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
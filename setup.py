@@ -19,7 +19,8 @@ setup(
     'pyyaml',
     'pyroute2',
     'timeago',
-    'colorama'
+    'colorama',
+    'cryptography'
   ],
   entry_points='''
     [console_scripts]
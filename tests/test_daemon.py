@@ -0,0 +1,32 @@
+import click
+
+from wgctl.commands.conn import up, sync
+from wgctl.commands.status import status, info
+from wgctl.util.daemon import absolute_instances
+
+@click.group()
+@click.option('--verbose', '-v', is_flag=True)
+@click.option('--trace-format')
+def main(verbose, trace_format):
+  pass
+
+for command in (up, sync, status, info):
+  main.add_command(command)
+
+def rewrite(argv):
+  with main.make_context('wgctl', list(argv), resilient_parsing=True) as context:
+    return absolute_instances(main, context, argv)
+
+def test_only_instances_are_made_absolute(tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+
+  for name in ('vpn.yml', 'start', 'status', 'json', '4'):
+    (tmp_path / name).write_text('')
+
+  vpn = str(tmp_path / 'vpn.yml')
+
+  assert rewrite(['start', 'vpn.yml', 'other']) == ['start', vpn, 'other']
+  assert rewrite(['-v', '--trace-format', 'json', 'start', '--jobs', '4', 'vpn.yml']) == ['-v', '--trace-format', 'json', 'start', '--jobs', '4', vpn]
+  assert rewrite(['status', '--format', 'json']) == ['status', '--format', 'json']
+  assert rewrite(['info', '--format=json', '--', 'vpn.yml']) == ['info', '--format=json', '--', vpn]
+  assert rewrite(['sync', '--fast', 'status']) == ['sync', '--fast', str(tmp_path / 'status')]
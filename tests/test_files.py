@@ -0,0 +1,29 @@
+import os
+import threading
+
+from wgctl.util.files import replace_file, private_directory
+
+def test_concurrent_writers(tmp_path):
+  target = str(tmp_path / 'cache')
+  payloads = [bytes([n]) * (1 << 20) for n in range(16)]
+
+  threads = [threading.Thread(target=replace_file, args=(target, payload)) for payload in payloads]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  with open(target, 'rb') as stream:
+    assert stream.read() in payloads
+
+  assert os.listdir(str(tmp_path)) == ['cache']
+  assert os.stat(target).st_mode & 0o777 == 0o600
+
+def test_private_directory_is_restricted(tmp_path):
+  directory = tmp_path / 'cache'
+  directory.mkdir(mode=0o755)
+  os.chmod(str(directory), 0o755)
+
+  private_directory(str(directory))
+
+  assert os.stat(str(directory)).st_mode & 0o777 == 0o700
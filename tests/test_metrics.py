@@ -0,0 +1,53 @@
+import errno
+import os
+
+from pyroute2.netlink.exceptions import NetlinkError
+from benchmarks.config import synthetic_config
+from benchmarks.fake import FakeWireGuard, capture_dump
+from wgctl.commands.metrics import render
+from wgctl.util import config, netlink
+
+PRIVATE_KEY = bytes(range(32))
+
+class DownWireGuard(FakeWireGuard):
+  """
+  Answers dumps for the given interfaces with ENODEV, as the kernel does for
+  a tunnel that is down
+  """
+
+  def __init__(self, replies, down):
+    FakeWireGuard.__init__(self, replies)
+    self.down = down
+
+  def put(self, msg, *args, **kwargs):
+    FakeWireGuard.put(self, msg, *args, **kwargs)
+
+    if msg.get_attr('WGDEVICE_A_IFNAME') in self.down:
+      self.pending = iter(())
+
+  def recv(self, bufsize):
+    for data in self.pending:
+      return data
+
+    raise NetlinkError(errno.ENODEV)
+
+def test_down_tunnel_is_counted(tmp_path, monkeypatch):
+  monkeypatch.setattr(config, 'CACHE_DIR', str(tmp_path / 'cache'))
+
+  paths = []
+  for name in ('up', 'down'):
+    path = tmp_path / '{}.yml'.format(name)
+    path.write_text(synthetic_config(3))
+    paths.append(str(path))
+
+  missing = str(tmp_path / 'missing')
+
+  _, tunnel = config.get_config(paths[0])
+  monkeypatch.setattr(netlink._sockets, 'wg', DownWireGuard(capture_dump('up', tunnel, PRIVATE_KEY), {'down', missing}), raising=False)
+
+  output = render(paths + [missing])
+
+  assert output.count('wireguard_peer_receive_bytes_total{interface="up"') == 3
+  assert 'interface="down"' not in output.split('# TYPE wireguard_peer_receive_bytes')[1]
+  assert 'wgctl_tunnel_errors 2\n' in output
+  assert output.endswith('# EOF\n')
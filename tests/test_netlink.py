@@ -0,0 +1,72 @@
+import datetime
+import struct
+
+from base64 import b64encode
+from pyroute2.netlink.nlsocket import Marshal
+from benchmarks.fake import FakeWireGuard, capture_dump, FAKE_PRID
+from socket import AF_INET6, inet_pton
+from wgctl.util import netlink
+from wgctl.util.model import Tunnel, Interface, Peer
+from wgctl.util.netlink import wgmsg
+
+PRIVATE_KEY = b64encode(bytes(range(32))).decode()
+HANDSHAKE = 1600000000
+
+TUNNEL = Tunnel(Interface('/dev/null', 51820), [
+  Peer(None, bytes([1]) * 32, endpoint='192.0.2.1:51820', allowed_ips=['10.0.0.1/32']),
+  Peer(None, bytes([2]) * 32, endpoint='[2001:db8::1]:51821', allowed_ips=['fd00::1/128']),
+  Peer(None, bytes([3]) * 32, allowed_ips=['10.0.0.3/32'])
+])
+
+EXPECTED = {
+  bytes([1]) * 32: ('192.0.2.1', 51820),
+  bytes([2]) * 32: ('2001:db8::1', 51821),
+  bytes([3]) * 32: None
+}
+
+def sent_endpoints(fast):
+  wg = FakeWireGuard()
+  wg.set_device(ifname='wg0', config=TUNNEL, private_key=PRIVATE_KEY, fast=fast)
+
+  marshal = Marshal()
+  marshal.msg_map[FAKE_PRID] = wgmsg
+  endpoints = {}
+
+  for data in wg.sent:
+    for msg in marshal.parse(data):
+      for peer in msg.get_attr('WGDEVICE_A_PEERS') or []:
+        endpoint = peer.get_attr('WGPEER_A_ENDPOINT')
+        endpoints[peer.get_attr('WGPEER_A_PUBLIC_KEY')] = tuple(endpoint[:2]) if endpoint is not None else None
+
+  return endpoints
+
+def test_set_device_sends_endpoints():
+  assert sent_endpoints(fast=False) == EXPECTED
+
+def test_fast_set_device_sends_endpoints():
+  assert sent_endpoints(fast=True) == EXPECTED
+
+def test_dump_round_trip():
+  wg = FakeWireGuard(capture_dump('wg0', TUNNEL, bytes(32), handshake=HANDSHAKE))
+  handshake = datetime.datetime.fromtimestamp(HANDSHAKE)
+
+  for peer in wg.iter_peers(ifname='wg0'):
+    endpoint = peer.get('endpoint')
+    assert (tuple(endpoint[:2]) if endpoint is not None else None) == EXPECTED[peer['public_key']]
+    assert peer['last_handshake_time'] == handshake
+
+  for peer in wg.iter_peer_views(ifname='wg0'):
+    endpoint = peer.endpoint
+    assert (tuple(endpoint[:2]) if endpoint is not None else None) == EXPECTED[bytes(peer.public_key)]
+    assert peer.last_handshake_time == handshake
+
+def test_dump_scope_id(monkeypatch):
+  # sin6_flowinfo is in network byte order, sin6_scope_id in host byte order
+  sockaddr = struct.pack('H', AF_INET6) + struct.pack('!HI16s', 51820, 5, inet_pton(AF_INET6, 'fe80::1')) + struct.pack('I', 3)
+  monkeypatch.setattr(netlink, 'pack_endpoint', lambda endpoint: sockaddr)
+
+  tunnel = Tunnel(TUNNEL.interface, [Peer(None, bytes([1]) * 32, endpoint='[fe80::1]:51820', allowed_ips=['fd00::1/128'])])
+  wg = FakeWireGuard(capture_dump('wg0', tunnel, bytes(32)))
+
+  assert [peer['endpoint'] for peer in wg.iter_peers(ifname='wg0')] == [('fe80::1', 51820, 5, 3)]
+  assert [peer.endpoint for peer in wg.iter_peer_views(ifname='wg0')] == [('fe80::1', 51820, 5, 3)]
@@ -1,108 +1,260 @@
 import click
+import errno
 
-from wgctl.util.cli import ok, fatal, info
-from wgctl.util.config import get_config
-from wgctl.util.netlink import WireGuard
+from wgctl.util import trace, monitor
+from wgctl.util.cli import ok, fatal, info, error, dim
+from wgctl.util.config import get_config, all_instances
+from wgctl.util.netlink import wireguard, iproute
 from wgctl.util.network import parse_net
-from pyroute2 import IPRoute
+from wgctl.util.routing import tunnel_routes, live_routes, has_default
+from wgctl.util.routing import add_route, delete_route, add_default, delete_default, RouteBatch
+from wgctl.util.diff import diff_device
+from wgctl.util.pool import run_all
+from wgctl.util.resolver import resolve_endpoints
 
-@click.command('start', help='starts up a tunnel')
+@click.command('start', help='starts up tunnels')
 @click.pass_context
-@click.argument('instance')
-def up(context, instance):
+@click.argument('instances', nargs=-1)
+@click.option('--all', 'everything', is_flag=True, help='start every tunnel in /etc/wireguard')
+@click.option('--jobs', '-j', type=int, default=8, help='number of tunnels handled concurrently')
+@click.option('--rate', type=int, help='maximum number of peers applied per second')
+@click.option('--fast', is_flag=True, help='encode netlink messages without pyroute2')
+def up(context, instances, everything=False, jobs=8, rate=None, fast=False):
+  run_tunnels(lambda instance: start_tunnel(context, instance, rate=rate, fast=fast), instances, everything, jobs)
+
+@click.command('stop', help='brings down tunnels')
+@click.pass_context
+@click.argument('instances', nargs=-1)
+@click.option('--all', 'everything', is_flag=True, help='stop every tunnel in /etc/wireguard')
+@click.option('--jobs', '-j', type=int, default=8, help='number of tunnels handled concurrently')
+def down(context, instances, everything=False, jobs=8):
+  run_tunnels(lambda instance: stop_tunnel(context, instance), instances, everything, jobs)
+
+@click.command('restart', help='restarts tunnels (reloading their configuration)')
+@click.pass_context
+@click.argument('instances', nargs=-1)
+@click.option('--all', 'everything', is_flag=True, help='restart every tunnel in /etc/wireguard')
+@click.option('--jobs', '-j', type=int, default=8, help='number of tunnels handled concurrently')
+def downup(context, instances, everything=False, jobs=8):
+  run_tunnels(lambda instance: restart_tunnel(context, instance), instances, everything, jobs)
+
+def run_tunnels(function, instances, everything, jobs):
+  """
+  Runs function on every given tunnel. A single tunnel is handled directly;
+  several are handled on a pool of jobs threads, each failure being reported
+  in a final summary instead of stopping the others.
+  """
+
+  if everything:
+    instances = all_instances()
+
+  if len(instances) == 0:
+    fatal('no tunnel given')
+  if len(instances) == 1 and not everything:
+    return function(instances[0])
+
+  failures = 0
+
+  for instance, failure in run_all(function, instances, jobs):
+    if failure is None:
+      ok(instance)
+    else:
+      error(instance, failure)
+      failures += 1
+
+  if failures > 0:
+    fatal('{} of {} tunnels failed'.format(failures, len(instances)))
+
+def start_tunnel(context, instance, rate=None, fast=False):
   instance, config = get_config(instance)
-  wg = WireGuard()
+  wg = wireguard()
 
   if wg.device_exists(ifname=instance):
     fatal('tunnel interface is already up.')
+
+  with trace.phase('resolve'):
+    config = resolve_endpoints(config)
   
-  try:
-    with open(config['interface']['private_key']) as key:
-      config['interface']['private_key'] = key.readline().strip()
-  except Exception:
-    fatal('could not read private key file')
+  with trace.phase('private key'):
+    private_key = read_private_key(config)
 
-  port = config['interface']['listen_port']
-  fwmark = config['interface'].get('fwmark')
+  port = config.interface.listen_port
 
   address, cidr = None, None
-  if config['interface'].get('address') is not None:
-    address, cidr = parse_net(config['interface']['address'])
+  if config.interface.address is not None:
+    address, cidr = parse_net(config.interface.address)
 
-  ip = IPRoute()
-  try:
-    ip.link('add', ifname=instance, kind='wireguard')
-  except Exception as e:
-    fatal('could not create device: {}'.format(e))
+  ip = iproute()
+  with trace.phase('link add'):
+    try:
+      ip.link('add', ifname=instance, kind='wireguard')
+    except Exception as e:
+      fatal('could not create device: {}'.format(e))
   
-  index = ip.link_lookup(ifname=instance)[0]
-  ip.link('set', index=index, state='up')
+    index = ip.link_lookup(ifname=instance)[0]
+    ip.link('set', index=index, state='up')
+    monitor.update(ip, index)
   
-  if address is not None and cidr is not None:
-    ip.addr('add', index=index, address=address, prefixlen=cidr)
+    if address is not None and cidr is not None:
+      ip.addr('add', index=index, address=address, prefixlen=cidr)
+
+  with trace.phase('set device'):
+    try:
+      stats = wg.set_device(ifindex=index, config=config, private_key=private_key, rate=rate, fast=fast)
+    except Exception as e:
+      fatal('could not configure device: {}'.format(e))
+
+  if context.obj['verbose']:
+    report_apply(stats)
 
-  WireGuard().set_device(ifindex=index, config=config)
+  routes, default = tunnel_routes(config)
+  batch = RouteBatch()
 
-  for peer in config['peers']:
-    if peer.get('allowed_ips'):
-      for aip in peer['allowed_ips']:
-        try:
-          if aip == '0.0.0.0/0':
-            ip.route('add', dst='0.0.0.0/0', oif=index, table=port)
-            ip.rule('add', table=254, FRA_SUPPRESS_PREFIXLEN=0, priority=18000)
-            ip.rule('add', fwmark=port, fwmask=0, table=port, priority=20000)
-          else:
-            ip.route('add', dst=aip, oif=index)
-        except Exception as e:
-          fatal('could not create route: {}'.format(e))
+  for net in routes:
+    add_route(batch, index, net)
+  if default:
+    add_default(batch, index, port)
 
-  if 'post_up' in config['interface']:
-    from wgctl.util.exec import run
+  with trace.phase('routes'):
+    failures = batch.commit(ip)
 
-    info('running post-up commands')
+  report_routes(failures, 'could not create')
 
-    for cmd in config['interface']['post_up']:
-      run(context, cmd)
+  if config.interface.post_up:
+    run_tunnel_hooks(context, 'post-up', config.interface.post_up, config.interface.batch_nft)
 
   ok('tunnel tunnel set up successfully')
 
-@click.command('stop', help='bring down a tunnel')
-@click.pass_context
-@click.argument('instance')
-def down(context, instance):
+def stop_tunnel(context, instance):
   instance, config = get_config(instance)
 
-  if not WireGuard().device_exists(ifname=instance):
+  if not wireguard().device_exists(ifname=instance):
     fatal('tunnel interface is already down.')
 
-  if 'pre_down' in config['interface']:
-    from wgctl.util.exec import run
+  if config.interface.pre_down:
+    run_tunnel_hooks(context, 'pre-down', config.interface.pre_down, config.interface.batch_nft)
 
-    info('running pre-down commands')
+  port = config.interface.listen_port
 
-    for cmd in config['interface']['pre_down']:
-      run(context, cmd)
+  ip = iproute()
+  index = ip.link_lookup(ifname=instance)[0]
+  routes, default = tunnel_routes(config)
+  batch = RouteBatch()
 
-  port = config['interface']['listen_port']
+  for net in routes:
+    delete_route(batch, index, net)
+  if default:
+    delete_default(batch, index, port)
 
-  ip = IPRoute()
-  ip.link('delete', ifname=instance)
+  with trace.phase('routes'):
+    failures = batch.commit(ip, ignore=(errno.ENOENT, errno.ESRCH))
 
-  nets = [peer.get('allowed_ips', []) for peer in config['peers']]
-  nets = [item for sublist in nets for item in sublist]
+  with trace.phase('link delete'):
+    ip.link('delete', index=index)
+    monitor.update(ip, index)
+
+  report_routes(failures, 'could not remove', abort=False)
 
-  if '0.0.0.0/0' in nets:
-    try:
-      ip.rule('delete', table=254, FRA_SUPPRESS_PREFIXLEN=0, priority=18000)
-      ip.rule('delete', fwmark=port, fwmask=0, table=port, priority=20000)
-    except:
-      pass
-  
   ok('tunnel brought down successfully')
 
-@click.command('restart', help='restarts a tunnel (reloading its configuration)')
+def restart_tunnel(context, instance):
+  stop_tunnel(context, instance)
+  start_tunnel(context, instance)
+
+@click.command('sync', help='applies configuration changes to a running tunnel')
 @click.pass_context
 @click.argument('instance')
-def downup(context, instance):
-  context.invoke(down, instance=instance)
-  context.invoke(up, instance=instance)
+@click.option('--fast', is_flag=True, help='encode netlink messages without pyroute2')
+def sync(context, instance, fast=False):
+  instance, config = get_config(instance)
+  wg = wireguard()
+
+  if not wg.device_exists(ifname=instance):
+    fatal('tunnel interface is down.')
+
+  with trace.phase('resolve'):
+    config = resolve_endpoints(config)
+
+  with trace.phase('private key'):
+    private_key = read_private_key(config)
+
+  with trace.phase('get device'):
+    device = wg.get_device_dict(ifname=instance)[instance]
+
+  index = device['ifindex']
+
+  with trace.phase('diff'):
+    interface, added, updated, removed = diff_device(device, config, private_key)
+
+  if len(interface) + len(added) + len(updated) + len(removed) > 0:
+    with trace.phase('set peers'):
+      try:
+        stats = wg.set_peers(ifindex=index, interface=interface, peers=added + updated, remove=removed, fast=fast)
+      except Exception as e:
+        fatal('could not update device: {}'.format(e))
+
+    if context.obj['verbose']:
+      report_apply(stats)
+
+  ip = iproute()
+  port = config.interface.listen_port
+  previous_port = device['listen_port']
+  routes, default = tunnel_routes(config)
+  current = live_routes(ip, index)
+
+  had_default = has_default(ip, index, previous_port)
+  batch = RouteBatch()
+
+  for net in current - routes:
+    delete_route(batch, index, net)
+  if had_default and (not default or port != previous_port):
+    delete_default(batch, index, previous_port)
+
+  for net in routes - current:
+    add_route(batch, index, net)
+  if default and (not had_default or port != previous_port):
+    add_default(batch, index, port)
+
+  # Routes that already exist without wgctl's protocol (installed by hand, or
+  # by an earlier version) are left as they are
+  with trace.phase('routes'):
+    failures = batch.commit(ip, ignore=(errno.EEXIST,))
+
+  report_routes(failures, 'could not update')
+
+  ok('tunnel synchronized ({} added, {} updated, {} removed)'.format(len(added), len(updated), len(removed)))
+
+def run_tunnel_hooks(context, name, hooks, batch_nft):
+  from time import perf_counter
+  from wgctl.util.exec import run_hooks
+
+  info('running {} commands'.format(name))
+
+  start = perf_counter()
+  with trace.phase(name):
+    timings = run_hooks(hooks, batch_nft=batch_nft)
+
+  if context.obj['verbose']:
+    for label, seconds in timings:
+      dim('{:7.1f} ms  {}'.format(seconds * 1000, label))
+
+    info('ran {} {} processes in {:.3f}s'.format(len(timings), name, perf_counter() - start))
+
+def report_routes(failures, message, abort=True):
+  for change, e in failures:
+    error(change, e)
+
+  if len(failures) > 0 and abort:
+    fatal('{} {} routes or rules'.format(message, len(failures)))
+
+def report_apply(stats):
+  rate = stats['peers'] / stats['time'] if stats['time'] > 0 else 0
+
+  info('applied {} peers in {} messages ({:.3f}s, {:.0f} peers/s)'.format(stats['peers'], stats['messages'], stats['time'], rate))
+
+def read_private_key(config):
+  try:
+    with open(config.interface.private_key) as key:
+      return key.readline().strip()
+  except Exception:
+    fatal('could not read private key file')
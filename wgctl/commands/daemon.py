@@ -0,0 +1,28 @@
+import click
+
+from wgctl.util.cli import ok, info, fatal
+from wgctl.util.daemon import Server, SOCKET_PATH
+
+@click.command(help='serves status, info and tunnel commands over a local socket')
+@click.pass_context
+@click.option('--socket', 'socket_path', default=SOCKET_PATH, help='path of the control socket')
+def serve(context, socket_path):
+  # pyroute2 is only loaded once the daemon actually starts, so that --help
+  # stays cheap
+  from wgctl.util import monitor
+
+  try:
+    monitor.start()
+  except OSError as e:
+    fatal('could not monitor network interfaces: {}'.format(e))
+
+  server = Server(socket_path)
+  ok('listening on {}'.format(socket_path))
+
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    info('shutting down')
+  finally:
+    server.server_close()
+    monitor.stop()
@@ -0,0 +1,39 @@
+import click
+
+from socket import AF_INET, AF_INET6, inet_pton
+from sys import exit
+from wgctl.util.cli import ok, error, fatal
+from wgctl.util.config import get_config, all_configs
+from wgctl.util.network import format_key
+
+@click.command(help='shows which peer an address is routed to')
+@click.pass_context
+@click.argument('address')
+@click.argument('instances', nargs=-1)
+def lookup(context, address, instances):
+  try:
+    inet_pton(AF_INET6 if ':' in address else AF_INET, address)
+  except OSError:
+    fatal('invalid address: {}'.format(address))
+
+  if len(instances) > 0:
+    configs = dict(get_config(instance) for instance in instances)
+  else:
+    configs = all_configs()
+
+  found = False
+
+  for instance, config in sorted(configs.items()):
+    match = config.route(address)
+    if match is None:
+      continue
+
+    net, peer = match
+    found = True
+
+    name = peer.description or format_key(peer.key)
+    ok('{}: {} (via {})'.format(instance, name, net), symbol='→')
+
+  if not found:
+    error('no tunnel routes {}'.format(address))
+    exit(1)
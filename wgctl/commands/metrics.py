@@ -0,0 +1,168 @@
+import click
+import sys
+import time
+
+from base64 import b64encode
+from contextlib import redirect_stdout
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from pyroute2.netlink.exceptions import NetlinkError
+from wgctl.util.cli import Abort, ok, info, warn, fatal
+from wgctl.util.config import get_config, all_instances, resolve_instance
+from wgctl.util.netlink import wireguard
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+@click.command(help='exports tunnel and peer statistics in OpenMetrics format')
+@click.pass_context
+@click.argument('instances', nargs=-1)
+@click.option('--listen', metavar='ADDRESS:PORT', help='serve the metrics over HTTP (e.g. 127.0.0.1:9586)')
+def metrics(context, instances, listen):
+  if listen is None:
+    print(render(instances), end='')
+    return
+
+  host, port = listen.rsplit(':', 1)
+  host = host.strip('[]')
+
+  try:
+    server = HTTPServer((host, int(port)), Handler)
+  except (OSError, ValueError) as e:
+    fatal('could not listen on {}: {}'.format(listen, e))
+
+  server.instances = instances
+  ok('serving metrics on http://{}/metrics'.format(listen))
+
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    info('shutting down')
+  finally:
+    server.server_close()
+
+class Handler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+
+    try:
+      body = render(self.server.instances).encode()
+    except (Exception, Abort) as e:
+      self.send_error(500, getattr(e, 'message', None) or str(e))
+      return
+
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+def load_configs(instances):
+  """
+  Returns the configurations of the given tunnels (all configured ones by
+  default) by name, and the number of them that could not be loaded. Those
+  are left out rather than failing the whole scrape, and their errors go to
+  stderr so as not to mix with the exposition.
+  """
+
+  configs, errors = {}, 0
+
+  with redirect_stdout(sys.stderr):
+    for instance in instances or all_instances():
+      try:
+        instance, config = get_config(instance)
+      except Abort:
+        instance, config = resolve_instance(instance)[0], None
+        errors += 1
+
+      configs[instance] = config
+
+  return configs, errors
+
+def render(instances=()):
+  """
+  Returns the OpenMetrics exposition of the given tunnels (all WireGuard
+  interfaces by default). Samples are built straight from the netlink dump,
+  and grouped by metric family as the format requires. Tunnels that cannot
+  be loaded or read are left out, and counted in wgctl_tunnel_errors.
+  """
+
+  wg = wireguard()
+  configs, errors = load_configs(instances)
+  interfaces = list(configs) if len(instances) > 0 else wg.get_devices()
+  now = time.time()
+
+  tunnels, rx, tx, handshake, age = [], [], [], [], []
+
+  for iface in interfaces:
+    config = configs.get(iface)
+    descriptions = {}
+    count = 0
+
+    if config is not None:
+      descriptions = {peer.key: escape(peer.description) for peer in config.peers if peer.description is not None}
+
+    # Label sets only differ in their key and description, so the rest of
+    # them is formatted once per tunnel
+    prefix = '{{interface="{}",public_key="'.format(escape(iface))
+
+    samples = ([], [], [], [])
+
+    try:
+      for peer in wg.iter_peer_views(ifname=iface):
+        key = peer.public_key
+        labels = prefix + b64encode(key).decode() + '",description="' + descriptions.get(key, '') + '"} '
+        last = max(0, peer.last_handshake)
+
+        samples[0].append(labels + str(peer.rx_bytes))
+        samples[1].append(labels + str(peer.tx_bytes))
+        samples[2].append(labels + str(last))
+        if last > 0:
+          samples[3].append(labels + str(round(now - last)))
+
+        count += 1
+    except NetlinkError as e:
+      # Such as a tunnel given by name that is down: it is left out like one
+      # whose configuration could not be loaded
+      warn('could not read statistics of {}: {}'.format(iface, e))
+
+      # Unless it was already counted for its configuration
+      if config is not None or iface not in configs:
+        errors += 1
+
+      continue
+
+    for column, tunnel_samples in zip((rx, tx, handshake, age), samples):
+      column += tunnel_samples
+
+    description = ''
+    if config is not None and config.description is not None:
+      description = config.description
+
+    tunnels.append('{{interface="{}",description="{}"}} {}'.format(escape(iface), escape(description), count))
+
+  return ''.join([
+    family('wireguard_tunnel_peers', 'gauge', 'Number of peers of the tunnel', tunnels),
+    family('wireguard_peer_receive_bytes', 'counter', 'Bytes received from the peer', rx, '_total'),
+    family('wireguard_peer_transmit_bytes', 'counter', 'Bytes sent to the peer', tx, '_total'),
+    family('wireguard_peer_last_handshake_seconds', 'gauge', 'Time of the last handshake, in seconds since the epoch', handshake),
+    family('wireguard_peer_handshake_age_seconds', 'gauge', 'Seconds elapsed since the last handshake', age),
+    family('wgctl_tunnel_errors', 'gauge', 'Number of tunnels whose configuration or statistics could not be read', [' {}'.format(errors)]),
+    '# EOF\n'
+  ])
+
+def family(name, kind, description, samples, suffix=''):
+  """
+  Returns a metric family, samples being label sets followed by their value
+  """
+
+  sample = '\n{}{}'.format(name, suffix)
+  lines = sample + sample.join(samples) if len(samples) > 0 else ''
+
+  return '# TYPE {0} {1}\n# HELP {0} {2}{3}\n'.format(name, kind, description, lines)
+
+def escape(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,142 @@
+import click
+import json
+import re
+import time
+import yaml
+
+from os import fstat, open as os_open, fdopen, O_WRONLY, O_CREAT, O_APPEND
+from wgctl.util.allocator import AddressPool
+from wgctl.util.cli import fatal, ok, info, warn
+from wgctl.util.config import Loader, get_config, resolve_instance, check_config
+from wgctl.util.files import replace_file
+from wgctl.util.keys import generate_keypairs
+
+PEERS_SECTION = re.compile(r'^peers:[ \t]*(#.*)?$', re.M)
+LIST_ITEM = re.compile(r'^([ \t]*)- ', re.M)
+
+@click.group(help='manages the peers of a tunnel')
+def peers():
+  pass
+
+@peers.command(help='adds peers with new keys and addresses to a tunnel')
+@click.pass_context
+@click.argument('instance')
+@click.option('--count', '-c', type=int, default=1, help='number of peers to add')
+@click.option('--description', default='peer {n}', help='description of the new peers, where {n} is replaced by their number')
+@click.option('--keepalive', type=int, help='persistent keepalive interval of the new peers')
+@click.option('--keys', 'keys_path', help='file to append the private keys of the new peers to (default: /etc/wireguard/<id>.keys)')
+@click.option('--jobs', '-j', type=int, help='number of processes generating keys (default: one per CPU)')
+def add(context, instance, count, description, keepalive, keys_path, jobs):
+  instance, config_path = resolve_instance(instance)
+  _, config = get_config(config_path)
+
+  if count < 1:
+    fatal('the number of peers must be positive')
+  if config.interface.address is None:
+    fatal('the interface must have an address to allocate peer addresses from')
+
+  start = time.perf_counter()
+
+  pool = AddressPool(config.interface.address)
+  pool.reserve(config.interface.address.split('/')[0])
+
+  for peer in config.peers:
+    for net in peer.allowed_ips:
+      pool.reserve(net)
+
+  addresses = []
+  for _ in range(count):
+    address = pool.allocate()
+    if address is None:
+      fatal('only {} free addresses left in {}'.format(len(addresses), config.interface.address))
+
+    addresses.append(address)
+
+  allocated = time.perf_counter()
+  keypairs = generate_keypairs(count, jobs)
+  generated = time.perf_counter()
+
+  first = len(config.peers) + 1
+  new_peers = []
+
+  for n, address, (private_key, public_key) in zip(range(first, first + count), addresses, keypairs):
+    peer = {'description': description.format(n=n), 'public_key': public_key}
+    if keepalive is not None:
+      peer['persistent_keepalive_interval'] = keepalive
+    peer['allowed_ips'] = [address]
+
+    new_peers.append((peer, private_key))
+
+  # The new document is validated before anything is written. Keys go first:
+  # peers without their private keys would be of no use
+  text, mode = add_peers(config_path, [peer for peer, _ in new_peers])
+
+  write_keys(keys_path or '/etc/wireguard/{}.keys'.format(instance), new_peers)
+  write_config(config_path, text, mode)
+
+  if context.obj['verbose']:
+    info('allocated {} addresses in {:.0f} ms, generated {} keypairs in {:.0f} ms'.format(
+      count, (allocated - start) * 1000, count, (generated - allocated) * 1000))
+
+  ok('{} peers added ({} to {}), {} addresses left'.format(count, addresses[0], addresses[-1], pool.free()))
+
+def add_peers(config_path, new_peers):
+  """
+  Returns the text of a configuration file with peers added, once validated,
+  along with the mode of the file. When the peers list is the last section of the file, the
+  new entries are appended to it as text, which keeps comments and
+  formatting; otherwise the whole document is written out again.
+  """
+
+  with open(config_path) as stream:
+    mode = fstat(stream.fileno()).st_mode
+    text = stream.read()
+
+  raw = yaml.load(text, Loader=Loader)
+  section = PEERS_SECTION.search(text)
+  item = LIST_ITEM.search(text, section.end()) if section is not None else None
+
+  if item is not None and len(raw.get('peers') or []) > 0 and list(raw)[-1] == 'peers':
+    if not text.endswith('\n'):
+      text += '\n'
+
+    text += ''.join(format_peer(peer, item.group(1)) for peer in new_peers)
+  else:
+    warn('the configuration file is rewritten, without its comments')
+
+    raw['peers'] = (raw.get('peers') or []) + new_peers
+    text = yaml.safe_dump(raw, default_flow_style=False, sort_keys=False)
+
+  check_config(yaml.load(text, Loader=Loader))
+
+  return text, mode
+
+def write_config(config_path, text, mode):
+  try:
+    replace_file(config_path, text.encode(), mode & 0o7777)
+  except OSError as e:
+    fatal('could not write {}: {}'.format(config_path, e))
+
+def format_peer(peer, indent):
+  lines = ['{}- description: {}'.format(indent, json.dumps(peer['description']))]
+  lines.append('{}  public_key: {}'.format(indent, peer['public_key']))
+
+  if 'persistent_keepalive_interval' in peer:
+    lines.append('{}  persistent_keepalive_interval: {}'.format(indent, peer['persistent_keepalive_interval']))
+
+  lines.append('{}  allowed_ips:'.format(indent))
+  lines += ['{}    - {}'.format(indent, net) for net in peer['allowed_ips']]
+
+  return '\n'.join(lines) + '\n'
+
+def write_keys(keys_path, new_peers):
+  """
+  Appends the description, address and private key of every new peer to a
+  file only readable by root, one tab-separated line per peer
+  """
+
+  try:
+    with fdopen(os_open(keys_path, O_WRONLY | O_CREAT | O_APPEND, 0o600), 'a') as stream:
+      stream.write(''.join('{}\t{}\t{}\n'.format(peer['description'], peer['allowed_ips'][0], private_key) for peer, private_key in new_peers))
+  except OSError as e:
+    fatal('could not write private keys to {}: {}'.format(keys_path, e))
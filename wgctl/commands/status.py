@@ -1,128 +1,231 @@
 import click
-import timeago
 
-from glob import glob
-from wgctl.util.cli import ok, error, fatal, dim
-from wgctl.util.config import get_config
-from wgctl.util.netlink import WireGuard
-from wgctl.util.network import format_key
+from wgctl.util import monitor
+from wgctl.util.cli import ok, error, fatal, dim, warn
+from wgctl.util.config import get_config, all_configs
+from wgctl.util.netlink import wireguard, close_sockets
+from wgctl.util.network import format_key, format_endpoint
+from wgctl.util.records import FORMATS, tunnel_record, peer_record, status_record, write_records
 from sys import exit
+from itertools import chain
 from colorama import Fore, Style
 from datetime import datetime
 
 @click.command(help='shows if a tunnel is up')
 @click.pass_context
 @click.argument('instance', required=False)
-def status(context, instance):
+@click.option('--format', 'output', type=click.Choice(FORMATS), default='text', help='output format')
+@click.option('--netns', help='look in this network namespace, or in all of them with "all"')
+@click.option('--jobs', '-j', type=int, default=8, help='number of namespaces queried concurrently')
+def status(context, instance, output='text', netns=None, jobs=8):
+  if netns == 'all':
+    return status_namespaces(context, instance, output, jobs)
   if instance is None:
-    return status_all(context)
+    return status_all(context, output, netns)
   
-  instance, _ = get_config(instance)
+  instance, config = get_config(instance)
+  up = is_up(instance, netns)
 
-  if not WireGuard().device_exists(instance):
+  if output != 'text':
+    write_records([status_record(instance, config, up, netns)], output)
+  elif not up:
     error('tunnel interface is down.')
-    exit(1)
   else:
     ok('tunnel interface is up', symbol='↑')
 
-def status_all(context):
-  interfaces = WireGuard().get_devices()
+  if not up:
+    exit(1)
+
+def status_all(context, output='text', netns=None):
+  if monitor.active is not None and netns is None:
+    interfaces = monitor.active.names()
+  else:
+    interfaces = wireguard(netns).get_devices()
+
+  configs = all_configs()
+  live = set(interfaces)
+
+  if output != 'text':
+    records = chain(
+      (status_record(iface, configs.get(iface), True, netns) for iface in interfaces),
+      (status_record(instance, config, False, netns) for instance, config in sorted(configs.items()) if instance not in live)
+    )
+
+    return write_records(records, output)
 
   for iface in interfaces:
-    if not iface.strip():
-      continue
-    
-    _, config = get_config(iface.strip())
-    description = iface
-    if 'description' in config is not None:
-      description = '{} ({})'.format(config['description'], iface.strip())
-
-    ok(description, symbol='↑')
-
-  for file in glob('/etc/wireguard/*.yml'):
-    instance, config = get_config(file)
-
-    if config is not None and not instance in interfaces:
-      description = instance
-      if 'description' in config:
-        description = '{} ({})'.format(config['description'], instance)
-      
-      dim(description, symbol='↓')
+    ok(describe(iface, configs.get(iface)), symbol='↑')
+
+  for instance, config in configs.items():
+    if not instance in live:
+      dim(describe(instance, config), symbol='↓')
+
+def status_namespaces(context, instance, output, jobs):
+  """
+  Lists the WireGuard interfaces of the current network namespace and of all
+  named ones, queried concurrently on a pool of jobs threads, along with the
+  configured tunnels that are up in none of them. With an instance, only
+  that tunnel is considered, and the exit status tells whether it is up
+  anywhere.
+  """
+
+  from wgctl.util.netns import names
+  from wgctl.util.pool import run_all
+
+  if instance is not None:
+    instance, config = get_config(instance)
+    configs = {instance: config}
+  else:
+    configs = all_configs()
+
+  namespaces = [None] + names()
+  devices = {}
+
+  # Pool threads do not outlive the command, and neither do their sockets
+  def query(netns):
+    try:
+      devices[netns] = wireguard(netns).get_devices()
+    finally:
+      close_sockets()
+
+  failures = [(netns, failure) for netns, failure in run_all(query, namespaces, jobs) if failure is not None]
+
+  up = [(netns, iface) for netns in namespaces for iface in devices.get(netns, []) if instance is None or iface == instance]
+  live = set(iface for _, iface in up)
+  down = [(name, config) for name, config in sorted(configs.items()) if name not in live]
+
+  if output != 'text':
+    records = chain(
+      (status_record(iface, configs.get(iface), True, netns) for netns, iface in up),
+      (status_record(name, config, False) for name, config in down)
+    )
+
+    write_records(records, output)
+  else:
+    for netns, iface in up:
+      name = describe(iface, configs.get(iface))
+      ok(name if netns is None else '{} in {}'.format(name, netns), symbol='↑')
+
+    for name, config in down:
+      dim(describe(name, config), symbol='↓')
+
+
+  # On stderr, so that JSON output stays parseable
+  for netns, failure in failures:
+    warn('could not query network namespace {}: {}'.format(netns or '(current)', failure))
+
+  if instance is not None and len(up) == 0:
+    exit(1)
+
+def is_up(instance, netns=None):
+  """
+  Answers from the daemon's link table when there is one, and asks the kernel
+  otherwise
+  """
+
+  if monitor.active is not None and netns is None:
+    return monitor.active.exists(instance)
+
+  return wireguard(netns).device_exists(instance)
+
+def describe(instance, config):
+  if config is not None and config.description is not None:
+    return '{} ({})'.format(config.description, instance)
+
+  return instance
     
 
 @click.command(help='shows information on a particular tunnel')
 @click.pass_context
 @click.argument('instance')
-def info(context, instance):
-  wg = WireGuard()
+@click.option('--format', 'output', type=click.Choice(FORMATS), default='text', help='output format')
+def info(context, instance, output='text'):
+  wg = wireguard()
 
-  if not wg.device_exists(instance):
+  if not is_up(instance):
     fatal('device does not exist')
 
   instance, config = get_config(instance)
-  interface = WireGuard().get_device_dict(ifname=instance)
-  interface = interface[instance]
+
+  # Peers are written out as they are decoded; the device attributes come
+  # first in the dump, and are known once the first peer has been read
+  device = {}
+  peers = wg.iter_peer_views(ifname=instance, device=device)
+  first = next(peers, None)
+  if first is not None:
+    peers = chain([first], peers)
+
+  if output != 'text':
+    records = chain([tunnel_record(instance, config, device)], (peer_record(instance, config, peer) for peer in peers))
+
+    return write_records(records, output)
 
   fwmark = None
-  if interface['fwmark'] > 0:
-    fwmark = interface['fwmark']
+  if device.get('fwmark', 0) > 0:
+    fwmark = device['fwmark']
+
+  public_key = None
+  if device.get('public_key'):
+    public_key = format_key(device['public_key'])
 
   attrs = [
     attr('interface:', instance),
-    attr('public key:', format_key(interface['public_key'])),
-    attr('listening port:', interface['listen_port']),
+    attr('public key:', public_key),
+    attr('listening port:', device.get('listen_port')),
     attr('fwmark:', fwmark)
   ]
 
-  output = print_tunnel(config.get('description', '<no tunnel description>'))
-  output += ''.join([line for line in attrs if line is not None])
+  print(print_tunnel(config.description or '<no tunnel description>'), end='')
+  print(''.join(attrs), end='')
 
-  for peer in interface.get('peers', []):
-    output += '\n'
-    
-    key = format_key(peer['public_key'])
-    peerconf = [peerconf for peerconf in config['peers'] if peerconf['public_key'] == key]
-    
-    description = '<no peer description>'
-    if len(peerconf) > 0 and 'description' in peerconf[0]:
-      description = peerconf[0]['description']
-
-    endpoint = None
-    if peer.get('endpoint'):
-      endpoint = '{}:{}'.format(peer['endpoint'][0], peer['endpoint'][1])
-
-    allowed_ips = None
-    if peer.get('allowedips'):
-      allowed_ips = ', '.join(peer['allowedips'])
-
-    if peer['last_handshake_time'].year == 1970:
-      handshake = None
-    else:
-      handshake = timeago.format(peer['last_handshake_time'], datetime.now())
-
-    if peer['persistent_keepalive_interval'] > 0:
-      keepalive = f'Every {peer["persistent_keepalive_interval"]}s'
-    else:
-      keepalive = None
-
-    rx_bytes = peer['rx_bytes']
-    tx_bytes = peer['tx_bytes']
-    traffic = rx_bytes + tx_bytes
-
-    attrs = [
-      attr('public key:', key, pad=4),
-      attr('endpoint:', endpoint, pad=4),
-      attr('allowed ips:', allowed_ips, pad=4),
-      attr('preshared key?', not all(c == '0' for c in peer['preshared_key'].hex()), pad=4),
-      attr('last handshake:', handshake, pad=4),
-      attr('persistent keepalive:', keepalive, pad=4),
-      attr('transfer:', f'↓ {rx_bytes} B ↑ {tx_bytes} B', rx_bytes + tx_bytes > 0, pad=4)
-    ]
-
-    output += print_peer(description)
-    output += ''.join([line for line in attrs if line is not None])
-
-  print(output)
+  for peer in peers:
+    print()
+    print(describe_peer(config, peer.to_dict()), end='')
+
+  print()
+
+def describe_peer(config, peer):
+  import timeago
+
+  key = format_key(peer['public_key'])
+  peerconf = config.peer(bytes(peer['public_key']))
+  
+  description = '<no peer description>'
+  if peerconf is not None and peerconf.description is not None:
+    description = peerconf.description
+
+  endpoint = None
+  if peer.get('endpoint'):
+    endpoint = format_endpoint(peer['endpoint'])
+
+  allowed_ips = None
+  if peer.get('allowedips'):
+    allowed_ips = ', '.join(peer['allowedips'])
+
+  if peer['last_handshake_time'].year == 1970:
+    handshake = None
+  else:
+    handshake = timeago.format(peer['last_handshake_time'], datetime.now())
+
+  if peer['persistent_keepalive_interval'] > 0:
+    keepalive = f'Every {peer["persistent_keepalive_interval"]}s'
+  else:
+    keepalive = None
+
+  rx_bytes = peer['rx_bytes']
+  tx_bytes = peer['tx_bytes']
+
+  attrs = [
+    attr('public key:', key, pad=4),
+    attr('endpoint:', endpoint, pad=4),
+    attr('allowed ips:', allowed_ips, pad=4),
+    attr('preshared key?', not all(c == '0' for c in peer['preshared_key'].hex()), pad=4),
+    attr('last handshake:', handshake, pad=4),
+    attr('persistent keepalive:', keepalive, pad=4),
+    attr('transfer:', f'↓ {rx_bytes} B ↑ {tx_bytes} B', rx_bytes + tx_bytes > 0, pad=4)
+  ]
+
+  return print_peer(description) + ''.join(attrs)
 
 def print_tunnel(description):
   return f'{Style.BRIGHT}{Fore.RED}tunnel:{Style.RESET_ALL} {description}\n'
@@ -0,0 +1,78 @@
+import click
+import time
+
+from wgctl.util.cli import fatal, format_size, format_rate, format_age
+from wgctl.util.config import get_config
+from wgctl.util.netlink import wireguard
+from wgctl.util.network import format_key
+from wgctl.util.snapshot import Snapshot
+
+@click.command(help='ranks the peers of a tunnel by traffic or handshake age')
+@click.pass_context
+@click.argument('instance')
+@click.option('--by', type=click.Choice(['total', 'rx', 'tx', 'handshake']), default='total', help='column to rank the peers by')
+@click.option('--count', '-n', type=int, default=20, help='number of peers to show')
+@click.option('--interval', type=float, help='rank by throughput over this many seconds instead of by counters')
+@click.option('--stale', type=int, metavar='SECONDS', help='only consider peers without a handshake in the last SECONDS')
+def top(context, instance, by, count, interval, stale):
+  instance, config = get_config(instance)
+  wg = wireguard()
+
+  try:
+    snapshot = Snapshot.capture(wg, instance)
+  except Exception as e:
+    fatal('could not read tunnel statistics: {}'.format(e))
+
+  rx, tx, unit = snapshot.rx, snapshot.tx, format_size
+
+  if interval is not None:
+    previous = snapshot
+    time.sleep(interval)
+
+    try:
+      snapshot = Snapshot.capture(wg, instance)
+    except Exception as e:
+      fatal('could not read tunnel statistics: {}'.format(e))
+
+    rx, tx, elapsed = snapshot.delta(previous)
+    rx = [value / elapsed for value in rx]
+    tx = [value / elapsed for value in tx]
+    unit = format_rate
+
+  start = time.perf_counter()
+  now = time.time()
+
+  positions = None
+  if stale is not None:
+    positions = snapshot.stale(stale, now=now)
+
+  if by == 'handshake':
+    ranked = snapshot.top(snapshot.handshake, count, reverse=False, positions=positions)
+  else:
+    column = {'rx': rx, 'tx': tx}.get(by)
+    if column is None:
+      column = [a + b for a, b in zip(rx, tx)] if interval is not None else snapshot.total()
+
+    ranked = snapshot.top(column, count, positions=positions)
+
+  elapsed = time.perf_counter() - start
+
+  print('{:>4}  {:<44} {:>12} {:>12}  {:<10} {}'.format('#', 'public key', 'rx', 'tx', 'handshake', 'description'))
+
+  for rank, position in enumerate(ranked, 1):
+    key = snapshot.key(position)
+    peer = config.peer(key)
+
+    description = ''
+    if peer is not None and peer.description is not None:
+      description = peer.description
+
+    age = None
+    if snapshot.handshake[position] > 0:
+      age = max(0, int(now - snapshot.handshake[position]))
+
+    print('{:>4}  {:<44} {:>12} {:>12}  {:<10} {}'.format(
+      rank, format_key(key), unit(rx[position]), unit(tx[position]), format_age(age), description))
+
+  if context.obj['verbose']:
+    print('{} peers ranked in {:.1f}ms'.format(len(snapshot), elapsed * 1000))
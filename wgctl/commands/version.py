@@ -1,10 +1,14 @@
 import click
-import pkg_resources
+
+from importlib import metadata
 
 @click.command()
 def version():
-  info = pkg_resources.require('wgctl')[0]
+  try:
+    number = metadata.version('wgctl')
+  except metadata.PackageNotFoundError:
+    number = 'unknown'
 
-  click.echo('{} version {}'.format(info.project_name, info.version))
+  click.echo('{} version {}'.format('wgctl', number))
   click.echo('Copyright © 2018 Antoine POPINEAU')
-  click.echo('Licence MIT')
\ No newline at end of file
+  click.echo('Licence MIT')
@@ -0,0 +1,191 @@
+import click
+import sys
+import time
+
+from shutil import get_terminal_size
+from wgctl.util.cli import fatal, format_rate, format_age
+from wgctl.util.config import get_config
+from wgctl.util.netlink import wireguard
+from wgctl.util.network import format_key
+
+@click.command(help='shows live per-peer throughput of a tunnel')
+@click.pass_context
+@click.argument('instance')
+@click.option('--interval', '-n', type=float, default=1.0, help='seconds between refreshes')
+@click.option('--sort', type=click.Choice(['rate', 'handshake', 'description']), default='rate', help='order of the peers')
+@click.option('--filter', 'pattern', help='only show peers whose description contains this text')
+@click.option('--min-rate', type=float, default=0, help='only show peers moving at least this many bytes per second')
+@click.option('--max-age', type=int, help='only show peers that completed a handshake in the last N seconds')
+@click.option('--count', type=int, help='exit after this many refreshes')
+def watch(context, instance, interval, sort, pattern, min_rate, max_age, count):
+  instance, config = get_config(instance)
+  wg = wireguard()
+
+  if not wg.device_exists(ifname=instance):
+    fatal('tunnel interface is down.')
+
+  view = View(instance, config, sort=sort, pattern=pattern, min_rate=min_rate, max_age=max_age)
+  out = sys.stdout
+
+  out.write('\x1b[?1049h\x1b[?25l\x1b[2J')
+
+  try:
+    ticks = 0
+    while count is None or ticks < count:
+      view.poll(wg)
+      view.draw(out)
+      ticks += 1
+
+      if count is None or ticks < count:
+        time.sleep(interval)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    out.write('\x1b[?25h\x1b[?1049l')
+    out.flush()
+
+class Row(object):
+  """
+  State of one peer between two polls. Rows are kept for the whole session
+  and updated in place; their rendered line is only rebuilt when one of the
+  displayed values changes.
+  """
+
+  __slots__ = ('key', 'description', 'rx', 'tx', 'rx_rate', 'tx_rate', 'handshake', 'age_label', 'line', 'seen')
+
+  def __init__(self, key, description):
+    self.key = key
+    self.description = description
+    self.rx = None
+    self.tx = None
+    self.rx_rate = 0.0
+    self.tx_rate = 0.0
+    self.handshake = 0
+    self.age_label = None
+    self.line = None
+    self.seen = 0
+
+  def update(self, rx, tx, handshake, elapsed, tick):
+    if self.rx is not None and elapsed > 0:
+      rx_rate = max(0, rx - self.rx) / elapsed
+      tx_rate = max(0, tx - self.tx) / elapsed
+
+      if rx_rate != self.rx_rate or tx_rate != self.tx_rate:
+        self.rx_rate, self.tx_rate = rx_rate, tx_rate
+        self.line = None
+
+    if handshake != self.handshake:
+      self.handshake = handshake
+      self.line = None
+
+    self.rx, self.tx, self.seen = rx, tx, tick
+
+  @property
+  def rate(self):
+    return self.rx_rate + self.tx_rate
+
+  def age(self, now):
+    if self.handshake == 0:
+      return None
+
+    return max(0, int(now - self.handshake))
+
+  def render(self, now):
+    """
+    Returns the row's line, which is only rebuilt when the rates or the
+    handshake age (bucketed by minute, so that idle rows stay cached) change
+    """
+
+    age_label = format_age(self.age(now))
+    if age_label != self.age_label:
+      self.age_label = age_label
+      self.line = None
+
+    if self.line is None:
+      self.line = '{:<44} {:>12} {:>12}  {:<10} {}'.format(
+        format_key(self.key), format_rate(self.rx_rate), format_rate(self.tx_rate),
+        age_label, self.description)
+
+    return self.line
+
+class View(object):
+  def __init__(self, instance, config, sort='rate', pattern=None, min_rate=0, max_age=None):
+    self.instance = instance
+    self.config = config
+    self.sort = sort
+    self.pattern = pattern
+    self.min_rate = min_rate
+    self.max_age = max_age
+    self.rows = {}
+    self.screen = []
+    self.polled = None
+    self.tick = 0
+
+  def poll(self, wg):
+    now = time.monotonic()
+    elapsed = now - self.polled if self.polled is not None else 0
+    self.polled = now
+    self.tick += 1
+
+    for peer in wg.iter_peer_views(ifname=self.instance):
+      key = peer.public_key
+      row = self.rows.get(key)
+
+      if row is None:
+        peerconf = self.config.peer(key)
+        description = ''
+        if peerconf is not None and peerconf.description is not None:
+          description = peerconf.description
+
+        key = bytes(key)
+        row = self.rows[key] = Row(key, description)
+
+      row.update(peer.rx_bytes, peer.tx_bytes, max(0, peer.last_handshake), elapsed, self.tick)
+
+    for key in [key for key, row in self.rows.items() if row.seen != self.tick]:
+      del self.rows[key]
+
+  def visible(self, now):
+    rows = self.rows.values()
+
+    if self.pattern is not None:
+      rows = [row for row in rows if self.pattern in row.description]
+    if self.min_rate > 0:
+      rows = [row for row in rows if row.rate >= self.min_rate]
+    if self.max_age is not None:
+      rows = [row for row in rows if row.age(now) is not None and row.age(now) <= self.max_age]
+
+    if self.sort == 'rate':
+      return sorted(rows, key=lambda row: row.rate, reverse=True)
+    elif self.sort == 'handshake':
+      return sorted(rows, key=lambda row: -row.handshake if row.handshake > 0 else 0)
+
+    return sorted(rows, key=lambda row: row.description)
+
+  def draw(self, out):
+    """
+    Writes only the screen lines that differ from the previous refresh
+    """
+
+    now = time.time()
+    height = get_terminal_size().lines
+    rows = self.visible(now)
+
+    rx = sum(row.rx_rate for row in rows)
+    tx = sum(row.tx_rate for row in rows)
+
+    lines = [
+      '{}: {} peers, {} shown  ↓ {} ↑ {}'.format(self.instance, len(self.rows), len(rows), format_rate(rx), format_rate(tx)),
+      '{:<44} {:>12} {:>12}  {:<10} {}'.format('public key', 'rx', 'tx', 'handshake', 'description')
+    ]
+    lines += [row.render(now) for row in rows[:max(0, height - len(lines))]]
+
+    for index, line in enumerate(lines):
+      if index >= len(self.screen) or self.screen[index] != line:
+        out.write('\x1b[{};1H{}\x1b[K'.format(index + 1, line))
+
+    if len(self.screen) > len(lines):
+      out.write('\x1b[{};1H\x1b[J'.format(len(lines) + 1))
+
+    self.screen = lines
+    out.flush()
@@ -1,32 +1,89 @@
 import click
 
 from os import getuid
+from importlib import import_module
 from wgctl.util.cli import fatal
-from base64 import b64encode
-
-from wgctl.commands import \
-  version, \
-  conn, \
-  status
 
 CONTEXT_SETTINGS=dict(help_option_names=['-h', '--help'])
 
-@click.group(context_settings=CONTEXT_SETTINGS)
+# Commands are only imported when they are about to run (or when listing them
+# for --help), so that each one only pays for the dependencies it uses.
+COMMANDS = {
+  'version': 'wgctl.commands.version:version',
+  'start': 'wgctl.commands.conn:up',
+  'stop': 'wgctl.commands.conn:down',
+  'restart': 'wgctl.commands.conn:downup',
+  'sync': 'wgctl.commands.conn:sync',
+  'status': 'wgctl.commands.status:status',
+  'info': 'wgctl.commands.status:info',
+  'serve': 'wgctl.commands.daemon:serve',
+  'metrics': 'wgctl.commands.metrics:metrics',
+  'watch': 'wgctl.commands.watch:watch',
+  'top': 'wgctl.commands.top:top',
+  'lookup': 'wgctl.commands.lookup:lookup',
+  'peers': 'wgctl.commands.peers:peers'
+}
+
+# Commands handed over to `wgctl serve` when it is running
+SERVED = ('status', 'info', 'start', 'stop', 'restart', 'sync')
+
+class Group(click.Group):
+  def __init__(self, *args, lazy_commands={}, **kwargs):
+    click.Group.__init__(self, *args, **kwargs)
+    self.lazy_commands = dict(lazy_commands)
+
+  def list_commands(self, context):
+    return sorted(set(click.Group.list_commands(self, context)) | set(self.lazy_commands))
+
+  def get_command(self, context, name):
+    if name not in self.commands and name in self.lazy_commands:
+      module, attr = self.lazy_commands[name].split(':')
+      self.add_command(getattr(import_module(module), attr), name)
+
+    return click.Group.get_command(self, context, name)
+
+  def parse_args(self, context, args):
+    context.meta['argv'] = list(args)
+
+    return click.Group.parse_args(self, context, args)
+
+@click.group(cls=Group, lazy_commands=COMMANDS, context_settings=CONTEXT_SETTINGS)
 @click.pass_context
 @click.option('--verbose', '-v', is_flag=True, default=False)
-def main(context, verbose):
+@click.option('--trace-timings', is_flag=True, help='report the time spent in every phase and the netlink traffic on stderr')
+@click.option('--trace-format', type=click.Choice(['table', 'json']), default='table', help='report timings as a table or as JSON trace events')
+@click.option('--netns', help='run in this network namespace (as created by ip netns)')
+def main(context, verbose, trace_timings, trace_format, netns):
   context.obj = {
     'verbose': verbose
   }
 
-  pass
+  if netns is not None:
+    from wgctl.util.netns import enter
+
+    try:
+      enter(netns)
+    except OSError as e:
+      fatal('could not enter network namespace {}: {}'.format(netns, e))
+
+  if trace_timings:
+    from wgctl.util import trace
+
+    tracer = trace.start()
+    context.call_on_close(lambda: tracer.report(trace_format))
+
+  # Traced commands are not handed over, so that the numbers are this
+  # process's, and neither are those for another namespace than the daemon's
+  # (such as status --netns, whose warnings would not reach the caller)
+  argv = context.meta['argv']
+  other_netns = any(arg == '--netns' or arg.startswith('--netns=') for arg in argv)
+
+  if context.invoked_subcommand in SERVED and not trace_timings and not other_netns:
+    from wgctl.util.daemon import forward, absolute_instances
+
+    code = forward(absolute_instances(context.command, context, argv))
+    if code is not None:
+      context.exit(code)
 
 if getuid() > 0:
   fatal('this should be run as root')
-
-main.add_command(version.version)
-main.add_command(conn.up)
-main.add_command(conn.down)
-main.add_command(conn.downup)
-main.add_command(status.status)
-main.add_command(status.info)
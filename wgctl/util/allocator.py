@@ -0,0 +1,98 @@
+import re
+
+from socket import AF_INET, inet_ntop
+from wgctl.util.prefixes import BITS, parse_prefix
+
+# At most this many addresses of a pool are tracked (2 MiB of bitmap), which
+# bounds large IPv6 pools to their first 16M addresses
+MAX_ADDRESSES = 1 << 24
+
+FREE_BYTE = re.compile(b'[^\xff]')
+
+class AddressPool(object):
+  """
+  Allocates host addresses from a network, with one bit per address: taken
+  addresses are reserved up front, then free ones are handed out in order.
+  The network address (or IPv6 subnet-router anycast address) and IPv4
+  broadcast address are never handed out.
+  """
+
+  def __init__(self, net):
+    self.family, self.network, length = parse_prefix(net)
+    self.bits = BITS[self.family]
+    self.size = min(1 << (self.bits - length), MAX_ADDRESSES)
+    self.bitmap = bytearray((self.size + 7) // 8)
+    self.cursor = 0
+
+    # Bits past the end of the pool are set, so that they are never free
+    if self.size % 8 > 0:
+      self.bitmap[-1] = 0xff << (self.size % 8) & 0xff
+
+    self.mark(0, 0)
+    if self.family == AF_INET and length < 31:
+      self.mark(self.size - 1, self.size - 1)
+
+  def mark(self, first, last):
+    """
+    Marks the addresses at offsets first to last (inclusive) as taken
+    """
+
+    bitmap = self.bitmap
+
+    while first <= last and first % 8 > 0:
+      bitmap[first // 8] |= 1 << (first % 8)
+      first += 1
+
+    while last >= first and (last + 1) % 8 > 0:
+      bitmap[last // 8] |= 1 << (last % 8)
+      last -= 1
+
+    if first <= last:
+      bitmap[first // 8:(last + 1) // 8] = b'\xff' * ((last + 1 - first) // 8)
+
+  def reserve(self, net):
+    """
+    Marks the addresses of net that fall within the pool as taken
+    """
+
+    family, value, length = parse_prefix(net)
+    if family != self.family:
+      return
+
+    first = value - self.network
+    last = first + (1 << (self.bits - length)) - 1
+
+    if last < 0 or first >= self.size:
+      return
+
+    self.mark(max(first, 0), min(last, self.size - 1))
+
+  def allocate(self):
+    """
+    Returns the next free address, as a single-address prefix, or None when
+    the pool is exhausted
+    """
+
+    match = FREE_BYTE.search(self.bitmap, self.cursor // 8)
+    if match is None:
+      return None
+
+    index = match.start()
+    byte = self.bitmap[index]
+    bit = (~byte & (byte + 1)).bit_length() - 1
+
+    self.bitmap[index] = byte | (1 << bit)
+    self.cursor = index * 8 + bit
+
+    address = (self.network + self.cursor).to_bytes(self.bits // 8, 'big')
+
+    return '{}/{}'.format(inet_ntop(self.family, address), self.bits)
+
+  def free(self):
+    """
+    Returns the number of addresses left in the pool
+    """
+
+    taken = bin(int.from_bytes(self.bitmap, 'little')).count('1')
+
+    return self.size - taken + (-self.size % 8)
@@ -1,9 +1,20 @@
-from sys import exit
+import sys
+
 from colorama import Fore, Style
 
+class Abort(SystemExit):
+  """
+  Raised by fatal(). It exits with status 1 like exit(1) would, but carries
+  the message so that callers running several tunnels can report it.
+  """
+
+  def __init__(self, message):
+    SystemExit.__init__(self, 1)
+    self.message = message
+
 def fatal(message):
   print('{}{}[✗]{} ERROR: {}'.format(Style.BRIGHT, Fore.RED, Fore.RESET, message))
-  exit(1)
+  raise Abort(message)
 
 def info(message):
   print('{}[-]{} {}'.format(Style.BRIGHT, Style.RESET_ALL, message))
@@ -14,8 +25,39 @@ def ok(message, symbol='✓'):
 def dim(message, symbol='-'):
   print('{}[{}] {}'.format(Style.DIM, symbol, message))
 
+def warn(message):
+  print('{}{}[!]{} {}'.format(Style.BRIGHT, Fore.YELLOW, Style.RESET_ALL, message), file=sys.stderr)
+
 def error(message, details=None):
   if details is None:
     print('{}{}[✗]{} {}'.format(Style.BRIGHT, Fore.RED, Fore.RESET, message))
   else:
-    print('{}{}[✗]{} {} ({})'.format(Style.BRIGHT, Fore.RED, Fore.RESET, message, details))
\ No newline at end of file
+    print('{}{}[✗]{} {} ({})'.format(Style.BRIGHT, Fore.RED, Fore.RESET, message, details))
+
+def format_size(size):
+  for unit in ('B', 'KiB', 'MiB', 'GiB'):
+    if size < 1024:
+      return '{:.0f} {}'.format(size, unit)
+
+    size /= 1024
+
+  return '{:.1f} TiB'.format(size)
+
+def format_rate(rate):
+  for unit in ('B/s', 'KiB/s', 'MiB/s'):
+    if rate < 1024:
+      return '{:.0f} {}'.format(rate, unit)
+
+    rate /= 1024
+
+  return '{:.1f} GiB/s'.format(rate)
+
+def format_age(age):
+  if age is None:
+    return 'never'
+  if age < 60:
+    return '< 1m'
+  if age < 3600:
+    return '{}m'.format(age // 60)
+
+  return '{}h'.format(age // 3600)
@@ -1,43 +1,468 @@
 import yaml
+import marshal
+import multiprocessing
 
-from os import path
+from os import path, environ, fstat, cpu_count
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
 from pathlib import Path
-from wgctl.util.cli import fatal
+from hashlib import blake2b, sha1
+from base64 import b64decode
+from ipaddress import ip_network
+from wgctl.util import trace
+from wgctl.util.cli import fatal, error, warn
+from wgctl.util.files import replace_file, private_directory
+from wgctl.util.model import Tunnel, Interface, Peer
+from wgctl.util.network import parse_endpoint
+from wgctl.util.prefixes import overlaps
+
+try:
+  from yaml import CSafeLoader as Loader
+except ImportError:
+  from yaml import SafeLoader as Loader
+
+CACHE_DIR = environ.get('WGCTL_CACHE_DIR', '/var/cache/wgctl')
+CACHE_VERSION = 5
+KEY_LEN = 32
+
+# Configurations already loaded by this process, which matters for long-running
+# ones such as `wgctl serve`. Entries are checked against the file like the
+# on-disk cache, and must not be modified by callers.
+_loaded = {}
+
+def resolve_instance(instance):
+  """
+  Returns the instance name and configuration path for an identifier or a
+  path to a configuration file
+  """
 
-def get_config(instance):
-  config_path = '/etc/wireguard/{}.yml'.format(instance)
   if path.isfile(instance):
-    config_path = instance
-    instance = Path(instance).resolve().stem
-  
+    return Path(instance).resolve().stem, instance
+
+  return instance, '/etc/wireguard/{}.yml'.format(instance)
+
+def get_config(instance):
+  instance, config_path = resolve_instance(instance)
+
   try:
-    with open(config_path) as stream:
-      config = yaml.load(stream)
+    with trace.phase('config'):
+      config = load_config(config_path)
   except FileNotFoundError:
     fatal('could not read file: {}'.format(config_path))
   except yaml.YAMLError:
     fatal('could not parse configuration')
 
-  check_config(config)
-
   return instance, config
 
-def check_config(config):
-  if config is None:
-    fail()
-  
-  if type(config.get('interface')) is not dict:
-    fail('there must be an interface definition')
-  if config['interface'].get('private_key') is None:
-    fail('the interface must have a private key')
-  if type(config['interface'].get('listen_port')) is not int:
-    fail('the interface must have an integer listening port')
-  
-  if type(config.get('peers', [])) is not list:
-    fail('the peers definition must be a list')
-
-def fail(message=None):
-  if message is None:
-    fatal('could not parse configuration')
+def all_instances():
+  return sorted(Path(file).stem for file in glob('/etc/wireguard/*.yml'))
+
+def all_configs():
+  configs = {}
+
+  for file in glob('/etc/wireguard/*.yml'):
+    instance, config = get_config(file)
+    configs[instance] = config
+
+  return configs
+
+def load_config(config_path):
+  """
+  Returns the parsed and validated Tunnel at config_path, along with the
+  peers of its shard directory, from memory or from the cache if the paths,
+  mtimes, sizes and content hashes of all files are unchanged. Otherwise,
+  only the shards that changed are parsed again.
+  """
+
+  data, key = read_file(config_path)
+  shards = [read_file(shard) for shard in sorted(glob(path.join(shard_directory(config_path), '*.yml')))]
+  key = key + tuple(shard_key for _, shard_key in shards)
+
+  loaded = _loaded.get(key[0])
+  if loaded is not None and loaded[0] == key:
+    return loaded[1]
+
+  config = cache_get(key)
+  if config is not None:
+    config = Tunnel.from_tuple(config)
+  else:
+    shards, errors = load_shards(shards)
+
+    try:
+      raw = yaml.load(data, Loader=Loader)
+    except yaml.YAMLError:
+      if len(errors) == 0:
+        raise
+
+      fail(['{}: could not parse configuration'.format(path.basename(config_path))] + errors)
+
+    config = check_config(raw, shards, errors)
+    cache_put(key, config.to_tuple())
+
+  _loaded[key[0]] = (key, config)
+
+  return config
+
+def shard_directory(config_path):
+  """
+  Returns the directory holding the peer shards of a configuration: vpn1.d
+  next to vpn1.yml. Every *.yml file in it is a list of peers.
+  """
+
+  return '{}.d'.format(path.splitext(config_path)[0])
+
+def read_file(file_path):
+  with open(file_path, 'rb') as stream:
+    stat = fstat(stream.fileno())
+    data = stream.read()
+
+  return data, (str(Path(file_path).resolve()), stat.st_mtime_ns, stat.st_size, blake2b(data).digest())
+
+def load_shards(shards):
+  """
+  Returns the peers of every shard as (origin, peers) pairs, from the cache
+  for unchanged shards, along with the problems found. The others are parsed
+  and validated on a pool of processes, one per CPU. Those are started from
+  a fork server rather than forked from this process, which may be running
+  other threads (start --all, or wgctl serve).
+  """
+
+  peers = [cache_get(key) for _, key in shards]
+  missing = [index for index, cached in enumerate(peers) if cached is None]
+
+  if len(missing) > 1 and (cpu_count() or 1) > 1:
+    context = multiprocessing.get_context('forkserver')
+
+    with ProcessPoolExecutor(max_workers=min(len(missing), cpu_count()), mp_context=context) as pool:
+      results = list(pool.map(parse_shard, [shards[index] for index in missing]))
+  else:
+    results = [parse_shard(shards[index]) for index in missing]
+
+  errors = []
+
+  for index, (shard_peers, shard_errors) in zip(missing, results):
+    errors += shard_errors
+    peers[index] = shard_peers
+
+    if len(shard_errors) == 0:
+      cache_put(shards[index][1], shard_peers)
+
+  return [(path.basename(key[0]), [Peer(*peer) for peer in shard_peers]) for (_, key), shard_peers in zip(shards, peers)], errors
+
+def parse_shard(shard):
+  """
+  Parses and validates a shard, and returns its peers as tuples along with
+  the problems found
+  """
+
+  data, key = shard
+  origin = path.basename(key[0])
+
+  try:
+    peers = yaml.load(data, Loader=Loader)
+  except yaml.YAMLError:
+    return [], ['{}: could not parse shard'.format(origin)]
+
+  if type(peers) is dict:
+    peers = peers.get('peers')
+  if type(peers) is not list:
+    return [], ['{}: a shard must be a list of peers'.format(origin)]
+
+  errors = []
+  peers = check_peers(peers, errors, origin)
+
+  return [peer.to_tuple() for peer in peers], errors
+
+def cache_path(key):
+  return path.join(CACHE_DIR, '{}.cache'.format(sha1(key[0].encode()).hexdigest()))
+
+def cache_get(key):
+  try:
+    with open(cache_path(key), 'rb') as stream:
+      version, cached, config = marshal.load(stream)
+  except (OSError, EOFError, ValueError, TypeError):
+    return None
+
+  if version != CACHE_VERSION or cached != key:
+    return None
+
+  return config
+
+def cache_put(key, config):
+  """
+  Stores a configuration in the cache. Failures are ignored: the cache is an
+  optimization, and the configuration directory may not be writable.
+  """
+
+  target = cache_path(key)
+
+  try:
+    private_directory(CACHE_DIR)
+    replace_file(target, marshal.dumps((CACHE_VERSION, key, config)))
+  except (OSError, ValueError):
+    pass
+
+def check_config(config, shards=(), errors=()):
+  """
+  Validates a raw configuration in a single pass and returns it as a Tunnel.
+  Peers already validated from shard files are given as (origin, peers)
+  pairs, and checked against the others for duplicate keys and allowed IPs.
+  Every problem found is reported before aborting, along with the given
+  errors found in the shards.
+  """
+
+  errors = list(errors)
+
+  if type(config) is not dict:
+    fail(['the configuration must be a mapping'] + errors)
+
+  interface = config.get('interface')
+  if type(interface) is not dict:
+    errors.append('there must be an interface definition')
+    interface = {}
   else:
-    fatal('could not parse configuration: {}'.format(message))
+    if type(interface.get('private_key')) is not str:
+      errors.append('the interface must have a private key')
+    if type(interface.get('listen_port')) is not int:
+      errors.append('the interface must have an integer listening port')
+    if interface.get('fwmark') is not None and type(interface['fwmark']) is not int:
+      errors.append('the interface firewall mark must be an integer')
+    if interface.get('address') is not None and not valid_net(interface['address']):
+      errors.append('the interface address must be a network in CIDR notation')
+    if type(interface.get('batch_nft', False)) is not bool:
+      errors.append('batch_nft must be a boolean')
+    for hook in ('post_up', 'pre_down'):
+      if type(interface.get(hook, [])) is not list:
+        errors.append('{} must be a list of commands'.format(hook))
+      else:
+        interface[hook] = check_hooks(hook, interface.get(hook) or [], errors) or None
+
+  peers = config.get('peers') or []
+  if type(peers) is not list:
+    errors.append('the peers definition must be a list')
+    peers = []
+
+  tunnel_peers = check_peers(peers, errors)
+  named = [(peer_name(None, index, peer.description), peer) for index, peer in enumerate(tunnel_peers)]
+
+  for origin, shard_peers in shards:
+    tunnel_peers += shard_peers
+    named += [(peer_name(origin, index, peer.description), peer) for index, peer in enumerate(shard_peers)]
+
+  check_peer_set(named, errors)
+
+  if len(errors) > 0:
+    fail(errors)
+
+  return Tunnel(
+    Interface(
+      interface['private_key'],
+      interface['listen_port'],
+      address=interface.get('address'),
+      fwmark=interface.get('fwmark'),
+      post_up=interface.get('post_up'),
+      pre_down=interface.get('pre_down'),
+      batch_nft=interface.get('batch_nft', False)
+    ),
+    tunnel_peers,
+    description=config.get('description')
+  )
+
+def peer_name(origin, index, description=None):
+  name = 'peer #{}'.format(index + 1)
+
+  if origin is not None:
+    name = '{} {}'.format(origin, name)
+  if description is not None:
+    name = '{} ({})'.format(name, description)
+
+  return name
+
+def check_peers(peers, errors, origin=None):
+  """
+  Validates a list of raw peers on their own and returns them as Peers
+  """
+
+  tunnel_peers = []
+
+  for index, peer in enumerate(peers):
+    if type(peer) is not dict:
+      errors.append('{}: must be a mapping'.format(peer_name(origin, index)))
+      continue
+
+    name = peer_name(origin, index, peer.get('description'))
+
+    key = decode_key(peer.get('public_key'))
+    if key is None:
+      errors.append('{}: public key must be {} base64-encoded bytes'.format(name, KEY_LEN))
+
+    preshared_key = None
+    if 'preshared_key' in peer:
+      try:
+        preshared_key = bytes.fromhex(peer['preshared_key'])
+      except (TypeError, ValueError):
+        pass
+      if preshared_key is None or len(preshared_key) != KEY_LEN:
+        errors.append('{}: pre-shared key must be {} hexadecimal characters'.format(name, KEY_LEN * 2))
+
+    keepalive = peer.get('persistent_keepalive_interval')
+    if keepalive is not None and type(keepalive) is not int:
+      errors.append('{}: persistent keepalive interval must be an integer'.format(name))
+
+    endpoint = peer.get('endpoint')
+    if endpoint is not None and not valid_endpoint(endpoint):
+      errors.append('{}: endpoint must be of the form host:port or [address]:port'.format(name))
+
+    allowed_ips = peer.get('allowed_ips') or []
+    if type(allowed_ips) is not list:
+      errors.append('{}: allowed IPs must be a list'.format(name))
+      allowed_ips = []
+    for net in allowed_ips:
+      if not valid_net(net):
+        errors.append('{}: invalid allowed IP {}'.format(name, net))
+
+    tunnel_peers.append(Peer(
+      peer.get('public_key'), key,
+      description=peer.get('description'),
+      preshared_key=preshared_key,
+      endpoint=endpoint,
+      persistent_keepalive_interval=keepalive,
+      allowed_ips=allowed_ips
+    ))
+
+  return tunnel_peers
+
+def check_peer_set(named, errors):
+  """
+  Checks (name, Peer) pairs against each other, for duplicate public keys
+  and allowed IPs
+  """
+
+  seen = {}
+  prefixes = []
+  invalid = len(errors) > 0
+
+  for name, peer in named:
+    if peer.key is not None:
+      if peer.key in seen:
+        errors.append('{}: duplicate public key (also used by {})'.format(name, seen[peer.key]))
+      else:
+        seen[peer.key] = name
+
+    prefixes += [(net, name) for net in peer.allowed_ips]
+
+  # Invalid allowed IPs have already been reported, and cannot be compared
+  if invalid:
+    return
+
+  nested = {}
+
+  for outer, owner, inner, other, duplicate in overlaps(prefixes):
+    if duplicate:
+      errors.append('{}: allowed IP {} is also allowed for {}'.format(other, inner, owner))
+    elif owner != other:
+      nested.setdefault((outer, owner), []).append((inner, other))
+
+  # Nested prefixes are legitimate (the most specific one wins), but worth
+  # knowing about; they are reported once per enclosing prefix
+  for (outer, owner), inners in nested.items():
+    inner, other = inners[0]
+    if len(inners) == 1:
+      warn('{}: allowed IP {} takes precedence over {} of {}'.format(other, inner, outer, owner))
+    else:
+      warn('{} allowed IPs of other peers (such as {} of {}) take precedence over {} of {}'.format(len(inners), inner, other, outer, owner))
+
+def check_hooks(name, hooks, errors):
+  """
+  Validates a list of hooks and returns it as a list of groups, each group
+  being a list of [command, timeout] pairs to run concurrently. A hook is
+  either a command, a mapping with a command and a timeout in seconds, or a
+  mapping with a list of such hooks under parallel (and a default timeout).
+  """
+
+  groups = []
+
+  for index, hook in enumerate(hooks):
+    label = '{} #{}'.format(name, index + 1)
+
+    if type(hook) is dict and 'parallel' in hook:
+      timeout = check_timeout(label, hook.get('timeout'), errors)
+      members = hook['parallel']
+
+      if type(members) is not list or len(members) == 0:
+        errors.append('{}: parallel must be a non-empty list of commands'.format(label))
+        continue
+
+      groups.append([check_hook(label, member, timeout, errors) for member in members])
+    else:
+      groups.append([check_hook(label, hook, None, errors)])
+
+  return groups
+
+def check_hook(label, hook, timeout, errors):
+  if type(hook) is str:
+    return [hook, timeout]
+
+  if type(hook) is not dict or type(hook.get('command')) is not str:
+    errors.append('{}: a hook must be a command, or a mapping with a command'.format(label))
+    return [None, None]
+
+  timeout = check_timeout(label, hook.get('timeout', timeout), errors)
+
+  return [hook['command'], timeout]
+
+def check_timeout(label, timeout, errors):
+  if timeout is not None and (type(timeout) not in (int, float) or timeout <= 0):
+    errors.append('{}: timeout must be a positive number of seconds'.format(label))
+    return None
+
+  return timeout
+
+def decode_key(key):
+  try:
+    key = b64decode(key, validate=True)
+  except (TypeError, ValueError):
+    return None
+
+  if len(key) != KEY_LEN:
+    return None
+
+  return key
+
+def valid_net(net):
+  """
+  Returns True for a prefix in CIDR notation with an integer length (which
+  ip_network() checks against the address family). Netmasks are refused,
+  as the prefix length is read as an integer everywhere else.
+  """
+
+  if type(net) is not str:
+    return False
+
+  try:
+    ip_network(net, strict=False)
+  except (TypeError, ValueError):
+    return False
+
+  _, _, length = net.partition('/')
+
+  return length.isdigit()
+
+def valid_endpoint(endpoint):
+  try:
+    parse_endpoint(endpoint)
+  except (AttributeError, ValueError):
+    return False
+
+  return True
+
+def fail(errors=[]):
+  if len(errors) > 1:
+    for message in errors:
+      error(message)
+
+    fatal('could not parse configuration ({} errors)'.format(len(errors)))
+  elif len(errors) == 1:
+    fatal('could not parse configuration: {}'.format(errors[0]))
+  else:
+    fatal('could not parse configuration')
@@ -0,0 +1,178 @@
+import io
+import json
+import socket
+import socketserver
+
+from os import environ, path, unlink, chmod
+from contextlib import redirect_stdout
+
+SOCKET_PATH = environ.get('WGCTL_SOCKET', '/run/wgctl.sock')
+
+# Set in the daemon process, so that the commands it runs are not forwarded
+# back to itself
+serving = False
+
+def forward(argv, socket_path=SOCKET_PATH):
+  """
+  Runs a command line through the daemon listening on socket_path and prints
+  its output. Returns the command's exit code, or None if no daemon could be
+  reached and the command should be run directly.
+  """
+
+  if serving or not path.exists(socket_path):
+    return None
+
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+  try:
+    client.connect(socket_path)
+  except OSError:
+    client.close()
+    return None
+
+  with client, client.makefile('rwb') as stream:
+    stream.write(json.dumps({'argv': argv}).encode() + b'\n')
+    stream.flush()
+
+    reply = stream.readline()
+
+  if not reply:
+    return None
+
+  reply = json.loads(reply)
+  print(reply['output'], end='')
+
+  return reply['code']
+
+def absolute_instances(group, context, argv):
+  """
+  Returns a command line with the instances given to the command as paths to
+  existing files made absolute, as the daemon does not run in the caller's
+  working directory. Every positional argument of the served commands is an
+  instance; the command name and option values are left alone.
+  """
+
+  commands = positionals(group, argv)
+  if len(commands) == 0:
+    return argv
+
+  start = commands[0] + 1
+  command = group.get_command(context, argv[commands[0]])
+  argv = list(argv)
+
+  if command is not None:
+    for index in positionals(command, argv[start:]):
+      if path.isfile(argv[start + index]):
+        argv[start + index] = path.abspath(argv[start + index])
+
+  return argv
+
+def positionals(command, args):
+  """
+  Returns the indices of the positional arguments in the arguments of a
+  click command, skipping its options and their values
+  """
+
+  takes_value = set()
+  for param in command.params:
+    if param.param_type_name == 'option' and not param.is_flag and not param.count:
+      takes_value.update(param.opts)
+
+  indices, value, options = [], False, True
+
+  for index, arg in enumerate(args):
+    if value:
+      value = False
+    elif options and arg == '--':
+      options = False
+    elif options and arg.startswith('-') and arg != '-':
+      value = arg in takes_value
+    else:
+      indices.append(index)
+
+  return indices
+
+def execute(argv):
+  """
+  Runs a command line in this process and returns its output and exit code.
+  Only the commands that are handed over to the daemon are run.
+  """
+
+  import click
+  from wgctl.main import main, SERVED
+
+  if served_command(argv) not in SERVED:
+    return 'error: only {} can be run through the daemon\n'.format(', '.join(SERVED)), 2
+
+  output = io.StringIO()
+
+  with redirect_stdout(output):
+    try:
+      main.main(args=argv, prog_name='wgctl', standalone_mode=False)
+      code = 0
+    except SystemExit as e:
+      code = e.code if type(e.code) is int else 1
+    except click.exceptions.Exit as e:
+      code = e.exit_code
+    except click.ClickException as e:
+      e.show(file=output)
+      code = e.exit_code
+    except Exception as e:
+      print('error: {}'.format(e))
+      code = 1
+
+  return output.getvalue(), code
+
+def served_command(argv):
+  """
+  Returns the command name of a command line, or None if it sets global
+  options that would change the daemon itself (such as --netns)
+  """
+
+  args = iter(argv)
+
+  for arg in args:
+    if arg in ('--verbose', '-v') or arg.startswith('--trace-format='):
+      continue
+    if arg == '--trace-format':
+      next(args, None)
+      continue
+
+    return None if arg.startswith('-') else arg
+
+  return None
+
+class Handler(socketserver.StreamRequestHandler):
+  def handle(self):
+    try:
+      request = json.loads(self.rfile.readline())
+      output, code = execute([str(arg) for arg in request['argv']])
+    except (ValueError, KeyError, TypeError) as e:
+      output, code = 'error: malformed request: {}\n'.format(e), 2
+
+    self.wfile.write(json.dumps({'output': output, 'code': code}).encode() + b'\n')
+
+class Server(socketserver.UnixStreamServer):
+  """
+  Serves command lines over a Unix socket, one at a time, so that every
+  request reuses the same netlink sockets and loaded configurations.
+  """
+
+  def __init__(self, socket_path=SOCKET_PATH):
+    global serving
+
+    serving = True
+
+    if path.exists(socket_path):
+      unlink(socket_path)
+
+    socketserver.UnixStreamServer.__init__(self, socket_path, Handler)
+    chmod(socket_path, 0o600)
+
+  def server_close(self):
+    socketserver.UnixStreamServer.server_close(self)
+
+    try:
+      unlink(self.server_address)
+    except OSError:
+      pass
@@ -0,0 +1,316 @@
+import struct
+import datetime
+
+from socket import AF_INET, AF_INET6, inet_ntop
+from wgctl.util.netlink import DEVICE_A, PEER_A, ALLOWEDIP_A, NLMSG_HDRLEN, GENL_HDRLEN, NLA_HDRLEN, WG_KEY_LEN
+
+# The kernel flags nested attributes, which the type has to be masked from
+NLA_TYPE_MASK = 0x3fff
+
+NLMSG_HEADER = struct.Struct('IH')
+NLA_HEADER = struct.Struct('HH')
+U8 = struct.Struct('B')
+U16 = struct.Struct('H')
+U32 = struct.Struct('I')
+U64 = struct.Struct('Q')
+TIMESPEC = struct.Struct('qq')
+SOCKADDR_PORT = struct.Struct('!H')
+
+DEVICE_NAMES = {index: name.replace('WGDEVICE_A_', '', 1).lower() for name, index in DEVICE_A.items() if name != 'WGDEVICE_A_UNSPEC'}
+
+IFINDEX = DEVICE_A['WGDEVICE_A_IFINDEX']
+IFNAME = DEVICE_A['WGDEVICE_A_IFNAME']
+PEERS = DEVICE_A['WGDEVICE_A_PEERS']
+
+PUBLIC_KEY = PEER_A['WGPEER_A_PUBLIC_KEY']
+PRESHARED_KEY = PEER_A['WGPEER_A_PRESHARED_KEY']
+ENDPOINT = PEER_A['WGPEER_A_ENDPOINT']
+KEEPALIVE = PEER_A['WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL']
+HANDSHAKE = PEER_A['WGPEER_A_LAST_HANDSHAKE_TIME']
+RX_BYTES = PEER_A['WGPEER_A_RX_BYTES']
+TX_BYTES = PEER_A['WGPEER_A_TX_BYTES']
+ALLOWEDIPS = PEER_A['WGPEER_A_ALLOWEDIPS']
+
+ALLOWEDIP_FAMILY = ALLOWEDIP_A['WGALLOWEDIP_A_FAMILY']
+ALLOWEDIP_IPADDR = ALLOWEDIP_A['WGALLOWEDIP_A_IPADDR']
+ALLOWEDIP_CIDR_MASK = ALLOWEDIP_A['WGALLOWEDIP_A_CIDR_MASK']
+
+class PeerView(object):
+  """
+  A peer of a GET_DEVICE dump, read in place from the received buffer. Only
+  the offsets of its attributes are recorded when it is created; values are
+  unpacked when accessed, keys are returned as memoryview slices (which hash
+  and compare like bytes) and addresses and datetimes are only built on
+  demand.
+  """
+
+  __slots__ = ('buf', 'key_at', 'psk_at', 'endpoint_at', 'keepalive_at', 'handshake_at', 'rx_at', 'tx_at', 'ips')
+
+  def __init__(self, buf, offset, end):
+    self.buf = buf
+    self.key_at = self.psk_at = self.endpoint_at = self.keepalive_at = None
+    self.handshake_at = self.rx_at = self.tx_at = None
+    self.ips = []
+
+    for kind, start, stop in attributes(buf, offset, end):
+      if kind == PUBLIC_KEY:
+        self.key_at = start
+      elif kind == PRESHARED_KEY:
+        self.psk_at = start
+      elif kind == ENDPOINT:
+        self.endpoint_at = (start, stop)
+      elif kind == KEEPALIVE:
+        self.keepalive_at = start
+      elif kind == HANDSHAKE:
+        self.handshake_at = start
+      elif kind == RX_BYTES:
+        self.rx_at = start
+      elif kind == TX_BYTES:
+        self.tx_at = start
+      elif kind == ALLOWEDIPS:
+        self.ips.append((buf, start, stop))
+
+  @property
+  def public_key(self):
+    return self.buf[self.key_at:self.key_at + WG_KEY_LEN]
+
+  @property
+  def preshared_key(self):
+    if self.psk_at is None:
+      return None
+
+    return self.buf[self.psk_at:self.psk_at + WG_KEY_LEN]
+
+  @property
+  def endpoint(self):
+    """
+    The endpoint as (address, port), or (address, port, flowinfo, scope id)
+    for IPv6, as pyroute2 decodes it
+    """
+
+    if self.endpoint_at is None:
+      return None
+
+    start, stop = self.endpoint_at
+    family, = U16.unpack_from(self.buf, start)
+    port, = SOCKADDR_PORT.unpack_from(self.buf, start + 2)
+
+    if family == AF_INET:
+      return (inet_ntop(AF_INET, self.buf[start + 4:start + 8]), port)
+    elif family == AF_INET6:
+      flowinfo, = struct.unpack_from('!I', self.buf, start + 4)
+      # Unlike the other fields, sin6_scope_id is in host byte order
+      scope, = struct.unpack_from('I', self.buf, start + 24)
+      return (inet_ntop(AF_INET6, self.buf[start + 8:start + 24]), port, flowinfo, scope)
+
+    return None
+
+  @property
+  def persistent_keepalive_interval(self):
+    return self.unpack(U16, self.keepalive_at)
+
+  @property
+  def last_handshake(self):
+    """
+    Time of the last handshake in seconds since the epoch, 0 if none
+    """
+
+    return self.unpack(TIMESPEC, self.handshake_at)
+
+  @property
+  def last_handshake_time(self):
+    if self.handshake_at is None:
+      return None
+
+    return datetime.datetime.fromtimestamp(self.last_handshake)
+
+  @property
+  def rx_bytes(self):
+    return self.unpack(U64, self.rx_at)
+
+  @property
+  def tx_bytes(self):
+    return self.unpack(U64, self.tx_at)
+
+  @property
+  def allowed_ips(self):
+    nets = []
+
+    for buf, offset, end in self.ips:
+      for _, start, stop in attributes(buf, offset, end):
+        family, address, cidr = AF_INET, None, 0
+
+        for kind, value, value_end in attributes(buf, start, stop):
+          if kind == ALLOWEDIP_FAMILY:
+            family, = U16.unpack_from(buf, value)
+          elif kind == ALLOWEDIP_IPADDR:
+            address = buf[value:value_end]
+          elif kind == ALLOWEDIP_CIDR_MASK:
+            cidr, = U8.unpack_from(buf, value)
+
+        if address is not None:
+          nets.append('{}/{}'.format(inet_ntop(family, address), cidr))
+
+    return nets
+
+  def unpack(self, fmt, offset):
+    if offset is None:
+      return 0
+
+    return fmt.unpack_from(self.buf, offset)[0]
+
+  def to_dict(self):
+    """
+    Returns the peer as decode_peer() would
+    """
+
+    peer = {'public_key': bytes(self.public_key)}
+
+    if self.psk_at is not None:
+      peer['preshared_key'] = bytes(self.preshared_key)
+    if self.endpoint_at is not None:
+      peer['endpoint'] = self.endpoint
+    if self.keepalive_at is not None:
+      peer['persistent_keepalive_interval'] = self.persistent_keepalive_interval
+    if self.handshake_at is not None:
+      peer['last_handshake_time'] = self.last_handshake_time
+    if self.rx_at is not None:
+      peer['rx_bytes'] = self.rx_bytes
+    if self.tx_at is not None:
+      peer['tx_bytes'] = self.tx_bytes
+    if len(self.ips) > 0:
+      peer['allowedips'] = self.allowed_ips
+
+    return peer
+
+def decode_peers(buffers, prid, device=None):
+  """
+  Yields a PeerView for every peer in the dump replies held by buffers. If a
+  dict is given as device, it is filled with the device attributes as they
+  are read. A peer continued over several messages is yielded once.
+
+  Buffers must only hold the replies to one request, as yielded by
+  WireGuard.dump(): messages are not checked for their sequence number.
+  """
+
+  pending = None
+
+  for data in buffers:
+    view = memoryview(data)
+    offset = 0
+
+    while offset + NLMSG_HDRLEN <= len(view):
+      length, kind = NLMSG_HEADER.unpack_from(view, offset)
+      if length < NLMSG_HDRLEN:
+        break
+
+      if kind == prid:
+        for peer in decode_device(view, offset + NLMSG_HDRLEN + GENL_HDRLEN, offset + length, device):
+          if pending is not None and pending.public_key == peer.public_key:
+            pending.ips.extend(peer.ips)
+            continue
+
+          if pending is not None:
+            yield pending
+
+          pending = peer
+
+      offset += (length + 3) & ~3
+
+  if pending is not None:
+    yield pending
+
+def decode_device(buf, offset, end, device=None):
+  for kind, start, stop in attributes(buf, offset, end):
+    if kind == PEERS:
+      for _, peer, peer_end in attributes(buf, start, stop):
+        yield PeerView(buf, peer, peer_end)
+    elif device is not None:
+      name, value = DEVICE_NAMES.get(kind), None
+
+      if kind == IFNAME:
+        value = bytes(buf[start:stop]).rstrip(b'\0').decode()
+      elif kind in (IFINDEX, DEVICE_A['WGDEVICE_A_FLAGS'], DEVICE_A['WGDEVICE_A_FWMARK']):
+        value, = U32.unpack_from(buf, start)
+      elif kind == DEVICE_A['WGDEVICE_A_LISTEN_PORT']:
+        value, = U16.unpack_from(buf, start)
+      elif name is not None:
+        value = bytes(buf[start:stop])
+
+      if name is not None:
+        device.setdefault(name, value)
+
+def attributes(buf, offset, end):
+  """
+  Yields the (type, value offset, value end) of the attributes between offset
+  and end
+  """
+
+  while offset + NLA_HDRLEN <= end:
+    length, kind = NLA_HEADER.unpack_from(buf, offset)
+    if length < NLA_HDRLEN:
+      break
+
+    yield kind & NLA_TYPE_MASK, offset + NLA_HDRLEN, offset + length
+    offset += (length + 3) & ~3
+
+def decode_counters(buffers, prid, keys, rx, tx, handshake):
+  """
+  Appends the public key, traffic counters and last handshake second of
+  every peer in the dump replies held by buffers to the given columns (a
+  bytearray and three arrays), without creating any object per peer. This is
+  the inner loop of Snapshot.capture(), hence the inlined attribute walk.
+  Buffers must only hold the replies to one request, as for decode_peers().
+  """
+
+  last = None
+  unpack_nla = NLA_HEADER.unpack_from
+  unpack_u64 = U64.unpack_from
+  unpack_time = TIMESPEC.unpack_from
+
+  for data in buffers:
+    view = memoryview(data)
+    offset = 0
+
+    while offset + NLMSG_HDRLEN <= len(view):
+      length, kind = NLMSG_HEADER.unpack_from(view, offset)
+      if length < NLMSG_HDRLEN:
+        break
+
+      if kind == prid:
+        for attr, start, stop in attributes(view, offset + NLMSG_HDRLEN + GENL_HDRLEN, offset + length):
+          if attr != PEERS:
+            continue
+
+          for _, peer, peer_end in attributes(view, start, stop):
+            key, received, sent, seconds = None, 0, 0, 0
+
+            while peer + NLA_HDRLEN <= peer_end:
+              size, attr = unpack_nla(view, peer)
+              if size < NLA_HDRLEN:
+                break
+
+              attr &= NLA_TYPE_MASK
+              if attr == PUBLIC_KEY:
+                key = view[peer + NLA_HDRLEN:peer + NLA_HDRLEN + WG_KEY_LEN]
+              elif attr == RX_BYTES:
+                received, = unpack_u64(view, peer + NLA_HDRLEN)
+              elif attr == TX_BYTES:
+                sent, = unpack_u64(view, peer + NLA_HDRLEN)
+              elif attr == HANDSHAKE:
+                seconds, _ = unpack_time(view, peer + NLA_HDRLEN)
+
+              peer += (size + 3) & ~3
+
+            # Continuations of a peer split over several messages only carry
+            # its key and allowed IPs
+            if key is None or key == last:
+              continue
+
+            keys += key
+            rx.append(received)
+            tx.append(sent)
+            handshake.append(seconds)
+            last = key
+
+      offset += (length + 3) & ~3
@@ -0,0 +1,65 @@
+from wgctl.util.network import parse_key, normalize_endpoint
+from wgctl.util.routing import normalize
+
+EMPTY_KEY = bytes(32)
+
+def diff_device(device, config, private_key):
+  """
+  Compares a live device (as returned by WireGuard.get_device_dict) with a
+  tunnel configuration and its private key. Returns the interface attributes
+  that changed, the peers to add, the peers to update and the public keys of
+  the peers to remove.
+  """
+
+  wanted = config.interface
+  interface = {}
+
+  if device.get('listen_port') != wanted.listen_port:
+    interface['listen_port'] = wanted.listen_port
+  if device.get('fwmark', 0) != (wanted.fwmark or 0):
+    interface['fwmark'] = wanted.fwmark or 0
+  if bytes(device.get('private_key', EMPTY_KEY)) != parse_key('private_key', private_key):
+    interface['private_key'] = private_key
+
+  live = {bytes(peer['public_key']): peer for peer in device.get('peers', [])}
+  added, updated = [], []
+
+  for peer in config.peers:
+    current = live.pop(peer.key, None)
+
+    if current is None:
+      added.append(peer)
+    elif peer_changed(current, peer):
+      updated.append(explicit_peer(peer))
+
+  return interface, added, updated, list(live.keys())
+
+def peer_changed(live, peer):
+  allowed_ips = {normalize(aip) for aip in live.get('allowedips', [])}
+  if allowed_ips != {normalize(aip) for aip in peer.allowed_ips}:
+    return True
+
+  if bytes(live.get('preshared_key', EMPTY_KEY)) != (peer.preshared_key or EMPTY_KEY):
+    return True
+
+  if live.get('persistent_keepalive_interval', 0) != (peer.persistent_keepalive_interval or 0):
+    return True
+
+  # The kernel leaves out the endpoint of a peer that has none yet
+  if peer.endpoint is not None:
+    endpoint = live.get('endpoint')
+    if not endpoint or tuple(endpoint[:2]) != normalize_endpoint(peer.endpoint):
+      return True
+
+  return False
+
+def explicit_peer(peer):
+  """
+  Attributes missing from a peer definition are left alone by the kernel on
+  update, so the ones that can be unset are spelled out as their zero value.
+  """
+
+  return peer.replace(
+    preshared_key=peer.preshared_key or EMPTY_KEY,
+    persistent_keepalive_interval=peer.persistent_keepalive_interval or 0
+  )
@@ -1,16 +1,129 @@
-from subprocess import Popen, PIPE
-from wgctl.util.cli import ok, error, fatal
-from sys import exit
+import time
 
-def run(context, cmd):
-  try:
-    cmd = cmd.split(' ')  
-    process = Popen(cmd, env={'PATH': ''}, stdout=PIPE, stderr=PIPE)
-    _, stderr = process.communicate()
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from subprocess import Popen, PIPE, TimeoutExpired
+from wgctl.util import trace
+from wgctl.util.cli import error, fatal
+
+class HookError(Exception):
+  pass
+
+def run_hooks(groups, batch_nft=False):
+  """
+  Runs groups of hooks (as returned by config.check_hooks) one group after
+  the other, the hooks of a group concurrently. With batch_nft, consecutive
+  nft commands run as a single nft -f - invocation. Returns a (label,
+  seconds) pair for every process run.
+  """
+
+  timings = []
+
+  for group in plan(groups, batch_nft):
+    if len(group) == 1:
+      results = [attempt(*group[0])]
+    else:
+      with ThreadPoolExecutor(max_workers=len(group)) as pool:
+        results = list(pool.map(lambda step: attempt(*step), group))
+
+    failures = [failure for _, _, failure in results if failure is not None]
+    timings += [(label, seconds) for label, seconds, _ in results]
+
+    if len(failures) > 0:
+      for failure in failures:
+        error(failure)
 
-    if process.returncode != 0:
-      error('{}'.format(stderr.decode('utf-8').strip()))
       fatal('had to abort early, network stack might be in unknown state.')
-  except Exception as e:
-    error(e)
-    fatal('had to abort early, network stack might be in unknown state.')
+
+  return timings
+
+def plan(groups, batch_nft):
+  """
+  Turns groups of [command, timeout] hooks into groups of (argv, timeout,
+  input, label) steps
+  """
+
+  steps = []
+  batch = None
+
+  for group in groups:
+    rule = nft_rule(group[0][0]) if batch_nft and len(group) == 1 else None
+
+    if rule is not None and batch is not None and batch[0] == rule[0]:
+      batch[1].append(rule[1])
+      batch[2] = add_timeouts(batch[2], group[0][1])
+      continue
+
+    if batch is not None:
+      steps.append([nft_step(*batch)])
+      batch = None
+
+    if rule is not None:
+      batch = [rule[0], [rule[1]], group[0][1]]
+    else:
+      steps.append([(command.split(' '), timeout, None, command) for command, timeout in group])
+
+  if batch is not None:
+    steps.append([nft_step(*batch)])
+
+  return steps
+
+def nft_rule(command):
+  """
+  Returns the nft executable and statement of command, or None if it is not
+  a plain nft invocation
+  """
+
+  argv = command.split(' ')
+
+  if path.basename(argv[0]) != 'nft' or len(argv) < 2 or argv[1].startswith('-'):
+    return None
+
+  return argv[0], ' '.join(argv[1:])
+
+def nft_step(executable, rules, timeout):
+  if len(rules) == 1:
+    return [executable] + rules[0].split(' '), timeout, None, '{} {}'.format(executable, rules[0])
+
+  script = ''.join('{}\n'.format(rule) for rule in rules)
+
+  return [executable, '-f', '-'], timeout, script, '{} -f - ({} commands)'.format(executable, len(rules))
+
+def add_timeouts(first, second):
+  if first is None or second is None:
+    return None
+
+  return first + second
+
+def attempt(argv, timeout, script, label):
+  """
+  Runs a command with an empty environment, and returns its label, its wall
+  time and the reason it failed, or None
+  """
+
+  start = time.perf_counter()
+
+  try:
+    with trace.phase('hook: {}'.format(label)):
+      run(argv, timeout, script)
+    failure = None
+  except HookError as e:
+    failure = '{}: {}'.format(label, e)
+
+  return label, time.perf_counter() - start, failure
+
+def run(argv, timeout=None, script=None):
+  try:
+    process = Popen(argv, env={'PATH': ''}, stdin=PIPE if script is not None else None, stdout=PIPE, stderr=PIPE)
+  except OSError as e:
+    raise HookError(e)
+
+  try:
+    _, stderr = process.communicate(script.encode() if script is not None else None, timeout=timeout)
+  except TimeoutExpired:
+    process.kill()
+    process.communicate()
+    raise HookError('timed out after {}s'.format(timeout))
+
+  if process.returncode != 0:
+    raise HookError(stderr.decode('utf-8').strip() or 'exited with status {}'.format(process.returncode))
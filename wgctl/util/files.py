@@ -0,0 +1,37 @@
+import os
+
+from tempfile import mkstemp
+
+def replace_file(target, data, mode=0o600):
+  """
+  Replaces target with data (bytes) in one step, through a temporary file of
+  its own in the same directory, so that concurrent writers never install a
+  file another one is still writing
+  """
+
+  fd, temporary = mkstemp(dir=os.path.dirname(target) or '.', prefix='.{}.'.format(os.path.basename(target)), suffix='.tmp')
+
+  try:
+    with os.fdopen(fd, 'wb') as stream:
+      stream.write(data)
+
+    os.chmod(temporary, mode)
+    os.replace(temporary, target)
+  except BaseException:
+    try:
+      os.unlink(temporary)
+    except OSError:
+      pass
+
+    raise
+
+def private_directory(directory):
+  """
+  Creates a directory only accessible by its owner, or restricts an existing
+  one, which makedirs() leaves as it is
+  """
+
+  os.makedirs(directory, mode=0o700, exist_ok=True)
+
+  if os.stat(directory).st_mode & 0o077:
+    os.chmod(directory, 0o700)
@@ -0,0 +1,46 @@
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, PublicFormat, NoEncryption
+from wgctl.util.network import format_key
+
+# Below this many keys, starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+def generate_keypair():
+  """
+  Returns a new (private key, public key) pair, both base64-encoded as with
+  wg genkey and wg pubkey
+  """
+
+  private_key = X25519PrivateKey.generate()
+  public_key = private_key.public_key()
+
+  return (
+    format_key(private_key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())),
+    format_key(public_key.public_bytes(Encoding.Raw, PublicFormat.Raw))
+  )
+
+def generate_keypairs(count, jobs=None):
+  """
+  Returns count new keypairs, generated across jobs processes (one per CPU
+  by default)
+  """
+
+  jobs = jobs or os.cpu_count() or 1
+
+  if jobs == 1 or count < PARALLEL_THRESHOLD:
+    return generate_batch(count)
+
+  sizes = [count // jobs + (1 if index < count % jobs else 0) for index in range(jobs)]
+  keypairs = []
+
+  with ProcessPoolExecutor(max_workers=jobs) as executor:
+    for batch in executor.map(generate_batch, sizes):
+      keypairs += batch
+
+  return keypairs
+
+def generate_batch(count):
+  return [generate_keypair() for _ in range(count)]
@@ -0,0 +1,78 @@
+class Tunnel(object):
+  __slots__ = ('description', 'interface', 'peers', 'index', 'prefixes')
+
+  def __init__(self, interface, peers=[], description=None):
+    self.description = description
+    self.interface = interface
+    self.peers = peers
+    self.index = {peer.key: peer for peer in peers}
+    self.prefixes = None
+
+  def peer(self, key):
+    """
+    Returns the peer with the given raw public key, or None
+    """
+
+    return self.index.get(key)
+
+  def route(self, address):
+    """
+    Returns the (allowed IP, peer) pair WireGuard would send packets to the
+    given address to, or None. The prefix index is built on first use.
+    """
+
+    if self.prefixes is None:
+      from wgctl.util.prefixes import PrefixIndex
+
+      self.prefixes = PrefixIndex((net, peer) for peer in self.peers for net in peer.allowed_ips)
+
+    return self.prefixes.lookup(address)
+
+  def to_tuple(self):
+    return (self.description, self.interface.to_tuple(), [peer.to_tuple() for peer in self.peers])
+
+  @classmethod
+  def from_tuple(cls, data):
+    description, interface, peers = data
+
+    return cls(Interface(*interface), [Peer(*peer) for peer in peers], description)
+
+class Interface(object):
+  __slots__ = ('private_key', 'listen_port', 'address', 'fwmark', 'post_up', 'pre_down', 'batch_nft')
+
+  def __init__(self, private_key, listen_port, address=None, fwmark=None, post_up=None, pre_down=None, batch_nft=False):
+    self.private_key = private_key
+    self.listen_port = listen_port
+    self.address = address
+    self.fwmark = fwmark
+    self.post_up = post_up
+    self.pre_down = pre_down
+    self.batch_nft = batch_nft
+
+  def to_tuple(self):
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+class Peer(object):
+  __slots__ = ('public_key', 'key', 'description', 'preshared_key', 'endpoint', 'persistent_keepalive_interval', 'allowed_ips')
+
+  def __init__(self, public_key, key, description=None, preshared_key=None, endpoint=None, persistent_keepalive_interval=None, allowed_ips=[]):
+    self.public_key = public_key
+    self.key = key
+    self.description = description
+    self.preshared_key = preshared_key
+    self.endpoint = endpoint
+    self.persistent_keepalive_interval = persistent_keepalive_interval
+    self.allowed_ips = allowed_ips
+
+  def replace(self, **changes):
+    """
+    Returns a copy of the peer with the given attributes changed
+    """
+
+    fields = {name: getattr(self, name) for name in self.__slots__}
+    fields.update(changes)
+
+    return Peer(**fields)
+
+  def to_tuple(self):
+    return tuple(getattr(self, name) for name in self.__slots__)
@@ -0,0 +1,269 @@
+import errno
+import select
+import threading
+import time
+
+from pyroute2 import IPRoute
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink.rtnl import RTMGRP_LINK
+from wgctl.util.cli import warn
+from wgctl.util.netlink import WG_LINK_KIND, link_kind
+
+IFF_UP = 0x1
+
+MONITOR_GROUPS = RTMGRP_LINK
+
+# Delay before reloading the table after notifications could not be read
+RETRY_DELAY = 1.0
+
+# The table kept up to date by `wgctl serve`, if it is running in this process
+active = None
+
+class Link(object):
+  __slots__ = ('index', 'name', 'up')
+
+  def __init__(self, index, name, up):
+    self.index = index
+    self.name = name
+    self.up = up
+
+  def copy(self):
+    return Link(self.index, self.name, self.up)
+
+class LinkTable(object):
+  """
+  Keeps track of the WireGuard interfaces and their link state from rtnetlink
+  notifications, so that they can be looked up without a
+  netlink round-trip. Callbacks registered with on() are called with a copy
+  of the link when a tunnel appears, vanishes or changes state, from the
+  monitoring thread.
+
+  If notifications are lost (the socket buffer overflowed) or cannot be
+  applied, the subscription is renewed and the table reloaded from a dump,
+  and the tunnels that changed in the meantime are reported to the
+  callbacks. Notifications are read asynchronously: a command that creates
+  or deletes a link itself calls update() for the table to reflect it as
+  soon as it returns.
+  """
+
+  def __init__(self):
+    self.links = {}
+    self.lock = threading.Lock()
+    self.callbacks = { 'appear': [], 'vanish': [], 'change': [] }
+    self.socket = None
+    self.thread = None
+    self.running = False
+
+  def on(self, event, callback):
+    self.callbacks[event].append(callback)
+
+  def start(self):
+    """
+    Subscribes to link notifications, then fills the table from a
+    dump. Subscribing first means that no change can fall between the two,
+    and replaying a notification over the dump is harmless.
+    """
+
+    self.socket = IPRoute()
+    self.socket.bind(groups=MONITOR_GROUPS)
+
+    self.fill()
+
+    self.running = True
+    self.thread = threading.Thread(target=self.run, name='wgctl-monitor', daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.running = False
+
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+    if self.socket is not None:
+      self.socket.close()
+      self.socket = None
+
+  def fill(self):
+    """
+    Applies a dump of all links to the table
+    """
+
+    with IPRoute() as ip:
+      for link in ip.get_links():
+        self.apply(link)
+
+  def resync(self):
+    """
+    Subscribes again to notifications and replaces the table with one loaded
+    from a fresh dump, then fires the events missed in between
+    """
+
+    sock = IPRoute()
+
+    try:
+      sock.bind(groups=MONITOR_GROUPS)
+
+      fresh = LinkTable()
+      fresh.fill()
+    except Exception:
+      sock.close()
+      raise
+
+    self.socket.close()
+    self.socket = sock
+
+    with self.lock:
+      previous, self.links = self.links, fresh.links
+
+    for index in set(previous) | set(fresh.links):
+      before, after = previous.get(index), fresh.links.get(index)
+
+      if after is None:
+        self.fire('vanish', before.copy())
+      elif before is None:
+        self.fire('appear', after.copy())
+      elif (before.name, before.up) != (after.name, after.up):
+        self.fire('change', after.copy())
+
+  def run(self):
+    stale = False
+
+    while self.running:
+      try:
+        if stale:
+          self.resync()
+          stale = False
+
+        readable, _, _ = select.select([self.socket], [], [], 0.5)
+        if len(readable) == 0:
+          continue
+
+        for msg in self.socket.get():
+          self.apply(msg)
+      except Exception as e:
+        if stale:
+          warn('could not reload network interfaces: {}'.format(e))
+        else:
+          warn('lost track of network interfaces ({}), reloading them'.format(e))
+
+        stale = True
+        time.sleep(RETRY_DELAY)
+
+  def apply(self, msg):
+    event = msg.get('event')
+
+    if event not in ('RTM_NEWLINK', 'RTM_DELLINK'):
+      return
+
+    fired = self.apply_link(msg, event == 'RTM_DELLINK')
+
+    if fired is not None:
+      self.fire(*fired)
+
+  def update(self, ip, index):
+    """
+    Applies the current state of a link right away, without waiting for its
+    notification to be read. Replaying that notification afterwards is
+    harmless.
+    """
+
+    try:
+      links = ip.get_links(index)
+    except NetlinkError as e:
+      if e.code != errno.ENODEV:
+        raise
+
+      links = []
+
+    if len(links) > 0:
+      self.apply(links[0])
+      return
+
+    with self.lock:
+      known = self.links.pop(index, None)
+
+    if known is not None:
+      self.fire('vanish', known.copy())
+
+  def fire(self, event, link):
+    """
+    Calls the callbacks registered for event. One that fails is reported and
+    does not prevent the others from being called.
+    """
+
+    for callback in self.callbacks[event]:
+      try:
+        callback(link)
+      except Exception as e:
+        warn('{} callback failed for {}: {}'.format(event, link.name, e))
+
+  def apply_link(self, msg, deleted):
+    index = msg['index']
+
+    with self.lock:
+      known = self.links.get(index)
+
+      if deleted or link_kind(msg) != WG_LINK_KIND:
+        if known is None:
+          return None
+
+        del self.links[index]
+        return ('vanish', known.copy())
+
+      name = msg.get_attr('IFLA_IFNAME')
+      up = msg['flags'] & IFF_UP != 0
+
+      if known is None:
+        link = self.links[index] = Link(index, name, up)
+        return ('appear', link.copy())
+
+      if (known.name, known.up) == (name, up):
+        return None
+
+      known.name, known.up = name, up
+      return ('change', known.copy())
+
+  def get(self, name):
+    with self.lock:
+      for link in self.links.values():
+        if link.name == name:
+          return link.copy()
+
+    return None
+
+  def exists(self, name):
+    return self.get(name) is not None
+
+  def names(self):
+    with self.lock:
+      return [link.name for link in self.links.values()]
+
+def start():
+  """
+  Starts monitoring the tunnels of this process' network namespace, and
+  makes the commands it runs answer from the table
+  """
+
+  global active
+
+  active = LinkTable()
+  active.start()
+
+  return active
+
+def update(ip, index):
+  """
+  Reflects a link created or deleted by this process in the table, when
+  there is one
+  """
+
+  if active is not None:
+    active.update(ip, index)
+
+def stop():
+  global active
+
+  if active is not None:
+    active.stop()
+    active = None
@@ -1,31 +1,58 @@
 # Module adapted from artizirk's work
 # Original source: https://gist.github.com/artizirk/3a8efeee33fce34baf6047aed7205a2e
 
+import os
 import struct
 import socket
 from socket import AF_INET, AF_INET6
 from socket import inet_pton, inet_ntop
 
 import datetime
+import mmap
+import time
+import threading
 from base64 import b64encode, b64decode
 
 from pyroute2.netlink import NLM_F_REQUEST, NLM_F_DUMP, NLM_F_ACK
-from pyroute2.netlink import nla, nla_base
+from pyroute2.netlink import NLMSG_DONE, NLMSG_ERROR
+from pyroute2.netlink.exceptions import NetlinkError
+from pyroute2.netlink import nla, nla_base_string
 from pyroute2.netlink import genlmsg
 from pyroute2.netlink.generic import GenericNetlinkSocket
 
-from wgctl.util.network import parse_key, parse_net
+from wgctl.util.network import parse_key, parse_net, format_key, pack_endpoint, net_family
+from wgctl.util.model import Peer
 from wgctl.util.cli import fatal
+from wgctl.util import trace
 from pyroute2 import IPRoute
 
 WG_GENL_NAME = 'wireguard'
 WG_GENL_VERSION = 1
+WG_LINK_KIND = 'wireguard'
 
 WG_KEY_LEN = 32
 
 WG_CMD_GET_DEVICE = 0
 WG_CMD_SET_DEVICE = 1
 
+# Same bound as libmnl's MNL_SOCKET_BUFFER_SIZE, used by the wg tool
+WG_MSG_MAX_SIZE = min(mmap.PAGESIZE, 8192)
+
+WG_RECV_BUFSIZE = 65536
+
+NLMSG_HDRLEN = 16
+GENL_HDRLEN = 4
+NLA_HDRLEN = 4
+
+SOCKADDR_IN_LEN = 16
+SOCKADDR_IN6_LEN = 28
+
+WGDEVICE_F_REPLACE_PEERS = 1 << 0
+
+WGPEER_F_REMOVE_ME = 1 << 0
+WGPEER_F_REPLACE_ALLOWEDIPS = 1 << 1
+WGPEER_F_UPDATE_ONLY = 1 << 2
+
 class wgmsg(genlmsg):
   prefix = 'WGDEVICE_A_'
   nla_map = (
@@ -55,7 +82,7 @@ class wgmsg(genlmsg):
       ('WGPEER_A_ALLOWEDIPS', '*wgallowedip')
     )
 
-    class sockaddr(nla_base):
+    class sockaddr(nla_base_string):
       """
       # IPv4
       struct sockaddr_in {
@@ -74,26 +101,20 @@ class wgmsg(genlmsg):
       };
       """
 
-      fields = [('value', 's')]
-
-      def encode(self):
-        nla_base.encode(self)
-
       def decode(self):
-        nla_base.decode(self)
+        nla_base_string.decode(self)
         family = struct.unpack('H', self['value'][:2])[0]
         if family == AF_INET:
           port, host = struct.unpack('!H4s', self['value'][2:8])
           self.value = (inet_ntop(family, host), port)
         elif family == AF_INET6:
-          port, flowinfo, host, scopeid = struct.unpack('!HI16sI', self['value'][2:28])
+          port, flowinfo, host = struct.unpack('!HI16s', self['value'][2:24])
+          scopeid, = struct.unpack('I', self['value'][24:28])
           self.value = (inet_ntop(family, host), port, flowinfo, scopeid)
 
-    class timespec(nla):
-      fields = [('value', 's')]
-
+    class timespec(nla_base_string):
       def decode(self):
-        nla_base.decode(self)
+        nla_base_string.decode(self)
         sec, _ = struct.unpack('ll', self['value'])
         self.value = datetime.datetime.fromtimestamp(sec)
 
@@ -106,16 +127,29 @@ class wgmsg(genlmsg):
         ('WGALLOWEDIP_A_CIDR_MASK', 'uint8')
       )
 
+# Attribute types, in the order they are declared above
+DEVICE_A = {name: index for index, (name, _) in enumerate(wgmsg.nla_map)}
+PEER_A = {name: index for index, (name, _) in enumerate(wgmsg.wgpeer.nla_map)}
+ALLOWEDIP_A = {name: index for index, (name, _) in enumerate(wgmsg.wgpeer.wgallowedip.nla_map)}
+
 class WireGuard(GenericNetlinkSocket):
+  # The named network namespace the socket was opened in, if not the current
+  netns = None
+
   def __init__(self, *args, **kwargs):
     GenericNetlinkSocket.__init__(self, *args, **kwargs)
     GenericNetlinkSocket.bind(self, WG_GENL_NAME, wgmsg, *args, **kwargs)
 
-  def get_devices(self):
-    ip = IPRoute()
-    links = [link.get_attr('IFLA_IFNAME') for link in ip.get_links() if self.device_exists(link.get_attr('IFLA_IFNAME'))]
+  def get_devices(self, ip=None):
+    """
+    Returns the names of all WireGuard interfaces, from a single link dump
+    filtered on the link kind
+    """
 
-    return links
+    if ip is None:
+      ip = iproute(self.netns)
+
+    return [link.get_attr('IFLA_IFNAME') for link in ip.get_links() if link_kind(link) == WG_LINK_KIND]
 
   def device_exists(self, ifname=None, ifindex=None):
     """
@@ -158,54 +192,115 @@ class WireGuard(GenericNetlinkSocket):
     return self.nlm_request(msg, msg_type=self.prid, msg_flags=NLM_F_REQUEST | NLM_F_ACK | NLM_F_DUMP)
 
   def get_device_dict(self, *args, **kwargs):
-    msg = self.get_device_dump(*args, **kwargs)
-    ret = {}
-    for x in msg:
-      dev = ret[x.get_attr('WGDEVICE_A_IFNAME')] = {}
-      for key, val in x['attrs']:
-        key = key.replace(x.prefix, '', 1).lower()
-        if key == 'peers':
-          peers = []
-          for peer in val:
-            p = {}
-            peers.append(p)
-            for peer_key, peer_val in peer['attrs']:
-              peer_key = peer_key.replace(peer.prefix, '', 1).lower()
-              if peer_key == 'allowedips':
-                allowedips = []
-                for ips in peer_val:
-                  ip = ips.get_attr('WGALLOWEDIP_A_IPADDR')
-                  mask = ips.get_attr('WGALLOWEDIP_A_CIDR_MASK')
-                  allowedips.append('{}/{}'.format(ip, mask))
-                peer_val = allowedips
-              p[peer_key] = peer_val
-          val = peers
-        dev[key] = val
-    return ret
-
-  def set_device(self, ifname=None, ifindex=None, config={}):
-    msg = wgmsg()
-    msg['cmd'] = WG_CMD_SET_DEVICE
-    msg['version'] = WG_GENL_VERSION
+    device = {}
+    device['peers'] = [peer.to_dict() for peer in self.iter_peer_views(*args, device=device, **kwargs)]
 
-    if ifname != None:
-      msg['attrs'].append(['WGDEVICE_A_IFNAME', ifname])
-    elif ifindex != None:
-      msg['attrs'].append(['WGDEVICE_A_IFINDEX', ifindex])
-    else:
-      raise ValueError('ifname or ifindex are unset')
+    return {device['ifname']: device}
+
+  def iter_peers(self, ifname=None, ifindex=None, device=None):
+    """
+    Yields the peers of a device one at a time, as they are decoded from the
+    dump replies. If a dict is given as device, it is filled with the device
+    attributes before the first peer is yielded.
+
+    The kernel splits large dumps over several messages, and a peer with many
+    allowed IPs over consecutive messages: such a peer is yielded once, with
+    all its allowed IPs.
+    """
+
+    msg = self.device_msg(ifname=ifname, ifindex=ifindex, cmd=WG_CMD_GET_DEVICE)
+    pending = None
+
+    for data in self.dump(msg):
+      for reply in self.marshal.parse(data):
+        if reply['header']['type'] != self.prid:
+          continue
+
+        if device is not None:
+          for key, val in reply['attrs']:
+            if key != 'WGDEVICE_A_PEERS':
+              device.setdefault(key.replace(reply.prefix, '', 1).lower(), val)
+
+        for peer in reply.get_attr('WGDEVICE_A_PEERS') or []:
+          peer = decode_peer(peer)
+
+          if pending is not None and pending['public_key'] == peer['public_key']:
+            pending.setdefault('allowedips', []).extend(peer.get('allowedips', []))
+            continue
+
+          if pending is not None:
+            yield pending
+
+          pending = peer
+
+    if pending is not None:
+      yield pending
+
+  def iter_peer_views(self, ifname=None, ifindex=None, device=None):
+    """
+    Same as iter_peers(), but yields PeerView objects read in place from the
+    received buffers rather than decoded through pyroute2
+    """
+
+    from wgctl.util.decoder import decode_peers
+
+    msg = self.device_msg(ifname=ifname, ifindex=ifindex, cmd=WG_CMD_GET_DEVICE)
 
-    interface = config.get('interface')
-    if interface is None:
-      fatal('configuration is missing "interface" key')
+    yield from decode_peers(self.dump(msg), self.prid, device=device)
+
+  def dump(self, msg):
+    """
+    Sends a dump request and yields the raw buffers holding its replies as
+    they are received, up to and including the one carrying NLMSG_DONE.
+    Messages with another sequence number, such as the rest of an earlier
+    dump, are dropped. If the caller stops early, the remaining replies are
+    read and discarded, so that they are not left on the socket for the next
+    request.
+    """
+
+    seq = self.addr_pool.alloc()
+    done = True
+
+    try:
+      self.put(msg, msg_type=self.prid, msg_flags=NLM_F_REQUEST | NLM_F_DUMP, msg_seq=seq)
+      done = False
+
+      while not done:
+        try:
+          data, done = own_replies(self.recv(WG_RECV_BUFSIZE), seq)
+        except NetlinkError:
+          done = True
+          raise
+
+        if len(data) > 0:
+          yield data
+    finally:
+      ban = 0
+
+      if not done:
+        try:
+          while not done:
+            _, done = own_replies(self.recv(WG_RECV_BUFSIZE), seq)
+        except NetlinkError:
+          pass
+        except Exception:
+          # Replies may still arrive: do not reuse the sequence number soon
+          ban = 0xff
+
+      self.addr_pool.free(seq, ban=ban)
+
+  def set_device(self, ifname=None, ifindex=None, config=None, private_key=None, rate=None, fast=False):
+    msg = self.device_msg(ifname=ifname, ifindex=ifindex)
+
+    interface = config.interface
     
-    port = interface.get('listen_port')
-    pkey = interface.get('private_key')
+    port = interface.listen_port
+    pkey = private_key
     if not all([port, pkey]):
       fatal('interface must have at least a "private_key" and "listen_port"')
 
-    fwmark = interface.get('fwmark')
-    peers = config.get('peers')
+    fwmark = interface.fwmark
+    peers = config.peers
 
     if port != None:
       msg['attrs'].append(['WGDEVICE_A_LISTEN_PORT', port])
@@ -213,61 +308,360 @@ class WireGuard(GenericNetlinkSocket):
       msg['attrs'].append(['WGDEVICE_A_FWMARK', fwmark])
     if pkey != None:
       msg['attrs'].append(['WGDEVICE_A_PRIVATE_KEY', parse_key('private_key', pkey)])
+
+    return self.send_peers(msg, ((peer, 0) for peer in peers), rate=rate, fast=fast)
+
+  def set_peers(self, ifname=None, ifindex=None, interface={}, peers=[], remove=[], rate=None, fast=False):
+    """
+    Applies a partial update to a running device: only the given interface
+    attributes are changed, the given peers are created or updated (with their
+    allowed IPs replaced) and the given public keys are removed. Peers that are
+    not mentioned are left untouched, as are their sessions.
+    """
+
+    msg = self.device_msg(ifname=ifname, ifindex=ifindex)
+
+    if interface.get('listen_port') is not None:
+      msg['attrs'].append(['WGDEVICE_A_LISTEN_PORT', interface['listen_port']])
+    if interface.get('fwmark') is not None:
+      msg['attrs'].append(['WGDEVICE_A_FWMARK', interface['fwmark']])
+    if interface.get('private_key') is not None:
+      msg['attrs'].append(['WGDEVICE_A_PRIVATE_KEY', parse_key('private_key', interface['private_key'])])
+
+    peers = [(peer, WGPEER_F_REPLACE_ALLOWEDIPS) for peer in peers]
+    peers += [(Peer(format_key(key), key), WGPEER_F_REMOVE_ME) for key in remove]
+
+    return self.send_peers(msg, peers, rate=rate, fast=fast)
+
+  def send_peers(self, msg, peers, rate=None, fast=False):
+    """
+    Sends (peer, flags) pairs to the device identified in msg, spread over as
+    many SET_DEVICE messages as needed to stay under WG_MSG_MAX_SIZE. The
+    device attributes of msg are only sent with the first one. If rate is
+    given, sending is paced to at most that many peers per second. If fast is
+    set, messages are written by SetDeviceEncoder rather than by pyroute2.
+
+    Returns the number of peers, messages and the time spent applying them.
+    """
+
+    ident = [attr for attr in msg['attrs'] if attr[0] in ('WGDEVICE_A_IFNAME', 'WGDEVICE_A_IFINDEX')]
+    stats = {'peers': 0, 'messages': 0, 'time': 0.0}
+    start = time.monotonic()
+
+    encoder = None
+    if fast:
+      from wgctl.util.encoder import SetDeviceEncoder
+      encoder = SetDeviceEncoder(self.prid)
+
+    for batch in fragment_peers(peers, device_size(msg['attrs'])):
+      if encoder is not None:
+        self.raw_request(encoder.encode(msg['attrs'] if stats['messages'] == 0 else ident, batch))
+      else:
+        if stats['messages'] > 0:
+          msg = wgmsg()
+          msg['cmd'] = WG_CMD_SET_DEVICE
+          msg['version'] = WG_GENL_VERSION
+          msg['attrs'].extend(ident)
+
+        msg['attrs'].append(['WGDEVICE_A_PEERS', [encode_peer(peer, flags) for peer, flags, _ in batch]])
+        self.nlm_request(msg, msg_type=self.prid, msg_flags=NLM_F_REQUEST | NLM_F_ACK)
+
+      stats['messages'] += 1
+      stats['peers'] += sum(1 for _, _, first in batch if first)
+
+      if rate:
+        delay = stats['peers'] / rate - (time.monotonic() - start)
+        if delay > 0:
+          time.sleep(delay)
+
+    if stats['messages'] == 0:
+      self.nlm_request(msg, msg_type=self.prid, msg_flags=NLM_F_REQUEST | NLM_F_ACK)
+      stats['messages'] = 1
+
+    stats['time'] = time.monotonic() - start
+
+    return stats
+
+  def raw_request(self, data):
+    """
+    Sends an already encoded request, filling in its sequence number and port
+    id, and waits for its acknowledgement
+    """
+
+    seq = self.addr_pool.alloc()
+
+    try:
+      with self.lock[seq]:
+        self.backlog[seq] = []
+        struct.pack_into('II', data, 8, seq, self.epid or os.getpid())
+        self.sendto(data, (0, 0))
+
+        return self.get(msg_seq=seq)
+    finally:
+      self.addr_pool.free(seq, ban=0xff)
+
+  def device_msg(self, ifname=None, ifindex=None, cmd=WG_CMD_SET_DEVICE):
+    msg = wgmsg()
+    msg['cmd'] = cmd
+    msg['version'] = WG_GENL_VERSION
+
+    if ifname != None:
+      msg['attrs'].append(['WGDEVICE_A_IFNAME', ifname])
+    elif ifindex != None:
+      msg['attrs'].append(['WGDEVICE_A_IFINDEX', ifindex])
+    else:
+      raise ValueError('ifname or ifindex are unset')
+
+    return msg
+
+def own_replies(data, seq):
+  """
+  Returns the messages of a receive buffer that answer the request with
+  sequence number seq (the whole buffer if no other is found), and whether
+  the last of them ends the dump. Raises NetlinkError if the request failed.
+  """
+
+  parts, offset, foreign = [], 0, False
+
+  while offset + NLMSG_HDRLEN <= len(data):
+    length, kind, _, sequence = struct.unpack_from('IHHI', data, offset)
+    if length < NLMSG_HDRLEN:
+      break
+
+    end = offset + ((length + 3) & ~3)
+
+    if sequence != seq:
+      foreign = True
+    else:
+      parts.append((offset, end))
+
+      if kind == NLMSG_DONE:
+        return owned(data, parts, foreign), True
+      elif kind == NLMSG_ERROR:
+        code, = struct.unpack_from('i', data, offset + NLMSG_HDRLEN)
+        if code < 0:
+          raise NetlinkError(-code)
+
+        return owned(data, parts, foreign), True
+
+    offset = end
+
+  return owned(data, parts, foreign), False
+
+def owned(data, parts, foreign):
+  if not foreign:
+    return data
+
+  view = memoryview(data)
+
+  return b''.join(view[start:end] for start, end in parts)
+
+def encode_peer(peer, flags=0):
+  wgpeer = wgmsg.wgpeer()
+
+  if flags != 0:
+    wgpeer['attrs'].append(['WGPEER_A_FLAGS', flags])
+
+  if peer.preshared_key is not None:
+    wgpeer['attrs'].append(['WGPEER_A_PRESHARED_KEY', peer.preshared_key])
+
+  if peer.persistent_keepalive_interval is not None:
+    wgpeer['attrs'].append(['WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL', peer.persistent_keepalive_interval])
+
+  if peer.endpoint is not None:
+    try:
+      wgpeer['attrs'].append(['WGPEER_A_ENDPOINT', pack_endpoint(peer.endpoint)])
+    except ValueError:
+      raise ValueError('peer endpoint is malformed')
+  
+  wgpeer['attrs'].append(['WGPEER_A_PUBLIC_KEY', peer.key])
+
+  if len(peer.allowed_ips) > 0:
+    wgips = []
     
-    if peers is not None:
-      wgpeers = []
-      
-      for peer in peers:
-        wgpeer = wgmsg.wgpeer()
-
-        if 'preshared_key' in peer:
-          if len(peer['preshared_key']) != 64:
-            fatal('pre-shared key must be 64 hexadecimal characters')
-          
-          wgpeer['attrs'].append(['WGPEER_A_PRESHARED_KEY', bytearray.fromhex(peer['preshared_key'])])
-
-        if 'persistent_keepalive_interval' in peer:
-          try:
-            wgpeer['attrs'].append(['WGPEER_A_PERSISTENT_KEEPALIVE_INTERVAL', int(peer['persistent_keepalive_interval'])])
-          except ValueError:
-            pass
-
-        if 'endpoint' in peer:
-          try:
-            host, port = peer['endpoint'].rsplit(':')
-            port = int(port)
-            address = \
-              struct.pack('H', socket.AF_INET) + \
-              struct.pack('!H12s', port, socket.inet_aton(host))
-
-            addr = wgmsg.wgpeer.sockaddr()
-            addr.setvalue(address)
-
-            wgpeer['attrs'].append(['WGPEER_A_ENDPOINT', addr])
-          except ValueError:
-            raise ValueError('peer endpoint is malformed')
-        
-        if 'public_key' in peer:
-          wgpeer['attrs'].append(['WGPEER_A_PUBLIC_KEY', parse_key('public_key', peer['public_key'])])
-
-        if 'allowed_ips' in peer:
-          wgips = []
-          
-          for ip in peer['allowed_ips']:
-            net, cidr = ip.rsplit('/')
-            cidr = int(cidr)
-
-            wgip = wgmsg.wgpeer.wgallowedip()
-            wgip['attrs'].append(['WGALLOWEDIP_A_FAMILY', AF_INET])
-            wgip['attrs'].append(['WGALLOWEDIP_A_IPADDR', net])
-            wgip['attrs'].append(['WGALLOWEDIP_A_CIDR_MASK', cidr])
-
-            wgips.append(wgip)
-          
-          wgpeer['attrs'].append(['WGPEER_A_ALLOWEDIPS', wgips])
-
-        wgpeers.append(wgpeer)
-      
-      msg['attrs'].append(['WGDEVICE_A_PEERS', wgpeers])
+    for ip in peer.allowed_ips:
+      net, cidr = ip.rsplit('/')
+      cidr = int(cidr)
+
+      wgip = wgmsg.wgpeer.wgallowedip()
+      wgip['attrs'].append(['WGALLOWEDIP_A_FAMILY', net_family(net)])
+      wgip['attrs'].append(['WGALLOWEDIP_A_IPADDR', net])
+      wgip['attrs'].append(['WGALLOWEDIP_A_CIDR_MASK', cidr])
+
+      wgips.append(wgip)
+    
+    wgpeer['attrs'].append(['WGPEER_A_ALLOWEDIPS', wgips])
+
+  return wgpeer
+
+_sockets = threading.local()
+
+def wireguard(netns=None):
+  """
+  Returns the calling thread's WireGuard socket, opening it on first use so
+  that the generic netlink family is resolved once per thread. With netns,
+  the socket is opened in (and talks to) that network namespace.
+  """
+
+  if netns is not None:
+    return namespace_socket(WireGuard, netns)
+
+  if getattr(_sockets, 'wg', None) is None:
+    _sockets.wg = trace.instrument(WireGuard())
+
+  return _sockets.wg
+
+def iproute(netns=None):
+  """
+  Returns the calling thread's IPRoute socket, opening it on first use
+  """
+
+  if netns is not None:
+    return namespace_socket(IPRoute, netns)
+
+  if getattr(_sockets, 'ip', None) is None:
+    _sockets.ip = trace.instrument(IPRoute())
+
+  return _sockets.ip
+
+def namespace_socket(kind, netns):
+  """
+  Returns the calling thread's socket of the given kind in a named network
+  namespace. A netlink socket stays bound to the namespace it was opened in,
+  so the thread only enters it to open the socket.
+  """
+
+  if getattr(_sockets, 'netns', None) is None:
+    _sockets.netns = {}
+
+  sock = _sockets.netns.get((kind, netns))
+
+  if sock is None:
+    from wgctl.util.netns import entered
+
+    with entered(netns):
+      sock = trace.instrument(kind())
+
+    sock.netns = netns
+    _sockets.netns[(kind, netns)] = sock
+
+  return sock
+
+def close_sockets():
+  """
+  Closes the sockets opened by the calling thread, for threads that are not
+  kept around, such as those of a pool
+  """
+
+  socks = [getattr(_sockets, 'wg', None), getattr(_sockets, 'ip', None)]
+  socks += (getattr(_sockets, 'netns', None) or {}).values()
+
+  _sockets.wg, _sockets.ip, _sockets.netns = None, None, None
+
+  for sock in socks:
+    if sock is not None:
+      sock.close()
+
+def link_kind(link):
+  return link.get_nested('IFLA_LINKINFO', 'IFLA_INFO_KIND')
+
+def decode_peer(peer):
+  p = {}
+
+  for key, val in peer['attrs']:
+    key = key.replace(peer.prefix, '', 1).lower()
+    if key == 'allowedips':
+      val = ['{}/{}'.format(ip.get_attr('WGALLOWEDIP_A_IPADDR'), ip.get_attr('WGALLOWEDIP_A_CIDR_MASK')) for ip in val]
+    p[key] = val
+
+  return p
+
+def fragment_peers(peers, header_size, max_size=WG_MSG_MAX_SIZE):
+  """
+  Groups (peer, flags) pairs into batches whose encoding fits in max_size
+  bytes once header_size bytes of message header and device attributes are
+  accounted for. As in the reference wg tool, a peer whose allowed IPs do not
+  fit is continued in the following batch, carrying only its public key and
+  the remaining allowed IPs, so that REPLACE_ALLOWEDIPS is applied only once.
+
+  Yields lists of (peer, flags, first) tuples, first being False for
+  continuations.
+  """
+
+  batch, size = [], header_size + NLA_HDRLEN
+
+  for peer, flags in peers:
+    allowed_ips = peer.allowed_ips
+    head = peer_size(peer, flags) + (NLA_HDRLEN if allowed_ips else 0)
+    index = 0
+
+    while True:
+      need = head
+      if index < len(allowed_ips):
+        need += allowedip_size(allowed_ips[index])
+
+      if len(batch) > 0 and size + need > max_size:
+        yield batch
+        batch, size = [], header_size + NLA_HDRLEN
+
+      size += head
+      end = index
+      while end < len(allowed_ips) and size + allowedip_size(allowed_ips[end]) <= max_size:
+        size += allowedip_size(allowed_ips[end])
+        end += 1
+
+      if index == 0:
+        if end < len(allowed_ips):
+          batch.append((peer.replace(allowed_ips=allowed_ips[:end]), flags, True))
+        else:
+          batch.append((peer, flags, True))
+      else:
+        batch.append((Peer(peer.public_key, peer.key, allowed_ips=allowed_ips[index:end]), 0, False))
+
+      if end >= len(allowed_ips):
+        break
+
+      index = end
+      head = NLA_HDRLEN + nla_size(WG_KEY_LEN) + NLA_HDRLEN
+
+  if len(batch) > 0:
+    yield batch
+
+def nla_size(length):
+  return NLA_HDRLEN + ((length + 3) & ~3)
+
+def device_size(attrs):
+  size = NLMSG_HDRLEN + GENL_HDRLEN
+
+  for name, value in attrs:
+    if name == 'WGDEVICE_A_IFNAME':
+      size += nla_size(len(value) + 1)
+    elif name == 'WGDEVICE_A_PRIVATE_KEY':
+      size += nla_size(WG_KEY_LEN)
+    else:
+      size += nla_size(4)
+
+  return size
+
+def peer_size(peer, flags=0):
+  """
+  Encoded size of a peer nest, without its allowed IPs
+  """
+
+  size = NLA_HDRLEN + nla_size(WG_KEY_LEN)
+
+  if flags != 0:
+    size += nla_size(4)
+  if peer.preshared_key is not None:
+    size += nla_size(WG_KEY_LEN)
+  if peer.persistent_keepalive_interval is not None:
+    size += nla_size(2)
+  if peer.endpoint is not None:
+    size += nla_size(SOCKADDR_IN6_LEN if peer.endpoint.startswith('[') else SOCKADDR_IN_LEN)
+
+  return size
+
+def allowedip_size(net):
+  address = 16 if ':' in net else 4
 
-    return self.put(msg, msg_type=self.prid, msg_flags=NLM_F_REQUEST)
+  return NLA_HDRLEN + nla_size(2) + nla_size(address) + nla_size(1)
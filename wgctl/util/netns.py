@@ -0,0 +1,49 @@
+import os
+
+from contextlib import contextmanager
+
+NETNS_RUN_DIR = '/var/run/netns'
+
+def names():
+  """
+  Returns the names of the network namespaces created with ip netns
+  """
+
+  try:
+    return sorted(os.listdir(NETNS_RUN_DIR))
+  except FileNotFoundError:
+    return []
+
+def enter(name):
+  """
+  Moves the calling thread to a named network namespace. Sockets it opens
+  afterwards, threads it starts and processes it runs all belong to that
+  namespace.
+  """
+
+  from pyroute2.netns import setns
+
+  setns(name, flags=0)
+
+@contextmanager
+def entered(name):
+  """
+  Runs a block in a named network namespace (or in the current one if name
+  is None), then moves the calling thread back. Namespaces are per thread,
+  so several threads may each be in a different one.
+  """
+
+  if name is None:
+    yield
+    return
+
+  from pyroute2.netns import setns
+
+  saved = os.open('/proc/thread-self/ns/net', os.O_RDONLY)
+
+  try:
+    setns(name, flags=0)
+    yield
+  finally:
+    setns(saved)
+    os.close(saved)
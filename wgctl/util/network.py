@@ -1,5 +1,8 @@
+import re
 import wgctl
+import struct
 
+from socket import AF_INET, AF_INET6, inet_pton, inet_ntop
 from base64 import b64encode, b64decode
 from wgctl.util.cli import fatal
 
@@ -24,3 +27,76 @@ def parse_net(net):
   cidr = int(cidr)
 
   return net, cidr
+
+HOSTNAME = re.compile(r'^(?=.{1,253}\.?$)([a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9])?\.)*[a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9])?\.?$', re.I)
+
+def parse_endpoint(endpoint):
+  """
+  Splits an endpoint of the form address:port, [address]:port for IPv6 or
+  hostname:port into its address family, host and port. The family of a
+  hostname is None until it is resolved.
+  """
+
+  host, _, port = endpoint.rpartition(':')
+
+  try:
+    port = int(port)
+  except ValueError:
+    raise ValueError('invalid endpoint port')
+
+  if not 0 < port < 65536:
+    raise ValueError('invalid endpoint port')
+
+  family = AF_INET
+  if host.startswith('[') and host.endswith(']'):
+    family, host = AF_INET6, host[1:-1]
+  elif not host.rstrip('.').rpartition('.')[2].isdigit() and HOSTNAME.match(host):
+    return None, host, port
+
+  try:
+    inet_pton(family, host)
+  except OSError:
+    raise ValueError('invalid endpoint address')
+
+  return family, host, port
+
+def normalize_endpoint(endpoint):
+  """
+  Returns the (address, port) of an endpoint given as a string, with the
+  address written the way the kernel reports it
+  """
+
+  family, host, port = parse_endpoint(endpoint)
+  if family is not None:
+    host = inet_ntop(family, inet_pton(family, host))
+
+  return host, port
+
+def format_endpoint(endpoint):
+  """
+  Formats an endpoint as decoded from netlink, (address, port, ...)
+  """
+
+  host, port = endpoint[0], endpoint[1]
+  if ':' in host:
+    return '[{}]:{}'.format(host, port)
+
+  return '{}:{}'.format(host, port)
+
+def pack_endpoint(endpoint):
+  """
+  Returns the struct sockaddr_in or sockaddr_in6 WireGuard expects for an
+  endpoint
+  """
+
+  family, host, port = parse_endpoint(endpoint)
+
+  if family is None:
+    raise ValueError('endpoint {} has not been resolved'.format(endpoint))
+  if family == AF_INET6:
+    return struct.pack('H', family) + struct.pack('!HI16s', port, 0, inet_pton(family, host)) + struct.pack('I', 0)
+
+  return struct.pack('H', family) + struct.pack('!H4s8x', port, inet_pton(family, host))
+
+def net_family(net):
+  return AF_INET6 if ':' in net else AF_INET
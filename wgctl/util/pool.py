@@ -0,0 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+from wgctl.util.cli import Abort
+
+def run_all(function, items, jobs):
+  """
+  Calls function on every item on a pool of at most jobs threads. Yields
+  (item, failure) pairs in order, failure being None on success or the
+  reason the call was aborted.
+  """
+
+  def attempt(item):
+    try:
+      function(item)
+    except Abort as e:
+      return e.message
+    except Exception as e:
+      return str(e) or type(e).__name__
+
+    return None
+
+  with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+    yield from zip(items, pool.map(attempt, items))
@@ -0,0 +1,92 @@
+from socket import AF_INET, AF_INET6, inet_pton
+
+BITS = { AF_INET: 32, AF_INET6: 128 }
+
+def parse_prefix(net):
+  """
+  Returns the address family, network (as an integer, host bits cleared) and
+  length of a prefix in CIDR notation
+  """
+
+  address, _, length = net.partition('/')
+  family = AF_INET6 if ':' in address else AF_INET
+  bits = BITS[family]
+  length = int(length) if length else bits
+
+  value = int.from_bytes(inet_pton(family, address), 'big')
+  value &= ((1 << bits) - 1) ^ ((1 << (bits - length)) - 1)
+
+  return family, value, length
+
+class PrefixIndex(object):
+  """
+  Longest-prefix match over a set of prefixes, with one hash table per
+  address family and prefix length: a lookup probes each length in use, from
+  the longest down, instead of scanning the prefixes.
+  """
+
+  def __init__(self, entries=()):
+    self.tables = { AF_INET: {}, AF_INET6: {} }
+    self.lengths = { AF_INET: [], AF_INET6: [] }
+
+    for net, owner in entries:
+      self.add(net, owner)
+
+  def add(self, net, owner):
+    family, value, length = parse_prefix(net)
+    table = self.tables[family].get(length)
+
+    if table is None:
+      table = self.tables[family][length] = {}
+      self.lengths[family] = sorted(self.tables[family], reverse=True)
+
+    table[value] = (net, owner)
+
+  def lookup(self, address):
+    """
+    Returns the (prefix, owner) pair of the most specific prefix containing
+    address, or None
+    """
+
+    family = AF_INET6 if ':' in address else AF_INET
+    bits = BITS[family]
+    value = int.from_bytes(inet_pton(family, address), 'big')
+    tables = self.tables[family]
+
+    for length in self.lengths[family]:
+      match = tables[length].get(value >> (bits - length) << (bits - length))
+      if match is not None:
+        return match
+
+    return None
+
+def overlaps(entries):
+  """
+  Finds the prefixes that contain or duplicate one another among the given
+  (prefix, owner) pairs, in a single sweep over them sorted by address.
+
+  Two prefixes either nest or are disjoint, so every prefix only needs to be
+  checked against the innermost prefix still open when it starts. Yields
+  (outer, outer owner, inner, inner owner, duplicate) tuples.
+  """
+
+  items = []
+
+  for net, owner in entries:
+    family, value, length = parse_prefix(net)
+    end = value | ((1 << (BITS[family] - length)) - 1)
+
+    items.append((family, value, length, end, net, owner))
+
+  items.sort(key=lambda item: item[:3])
+  stack = []
+
+  for family, value, length, end, net, owner in items:
+    while len(stack) > 0 and (stack[-1][0] != family or stack[-1][3] < value):
+      stack.pop()
+
+    if len(stack) > 0:
+      outer = stack[-1]
+      yield (outer[4], outer[5], net, owner, outer[1] == value and outer[2] == length)
+
+    stack.append((family, value, length, end, net, owner))
@@ -0,0 +1,82 @@
+import json
+import sys
+
+from wgctl.util.network import format_key, format_endpoint
+
+# Output formats of the commands that print records, besides text
+FORMATS = ('text', 'json', 'ndjson')
+
+def tunnel_record(instance, config, device):
+  """
+  Returns the record of a running tunnel, from the device attributes of a
+  GET_DEVICE dump
+  """
+
+  public_key = device.get('public_key')
+
+  return {
+    'type': 'tunnel',
+    'interface': instance,
+    'description': config.description,
+    'public_key': format_key(public_key) if public_key else None,
+    'listen_port': device.get('listen_port'),
+    'fwmark': device.get('fwmark') or None
+  }
+
+def peer_record(instance, config, peer):
+  """
+  Returns the record of a PeerView. Absent values are null, and the last
+  handshake is in seconds since the epoch.
+  """
+
+  key = bytes(peer.public_key)
+  peerconf = config.peer(key)
+  endpoint = peer.endpoint
+  preshared_key = peer.preshared_key
+
+  return {
+    'type': 'peer',
+    'interface': instance,
+    'public_key': format_key(key),
+    'description': peerconf.description if peerconf is not None else None,
+    'endpoint': format_endpoint(endpoint) if endpoint is not None else None,
+    'allowed_ips': peer.allowed_ips,
+    'preshared_key': preshared_key is not None and any(preshared_key),
+    'last_handshake': peer.last_handshake or None,
+    'persistent_keepalive_interval': peer.persistent_keepalive_interval or None,
+    'rx_bytes': peer.rx_bytes,
+    'tx_bytes': peer.tx_bytes
+  }
+
+def status_record(instance, config, up, netns=None):
+  return {
+    'type': 'status',
+    'interface': instance,
+    'description': config.description if config is not None else None,
+    'netns': netns,
+    'up': up
+  }
+
+def write_records(records, format, stream=None):
+  """
+  Writes records as they come, either as a JSON array or as one JSON object
+  per line, so that nothing but the current record is held in memory
+  """
+
+  stream = stream or sys.stdout
+
+  if format == 'ndjson':
+    for record in records:
+      stream.write(json.dumps(record))
+      stream.write('\n')
+
+    return
+
+  separator = '['
+
+  for record in records:
+    stream.write(separator)
+    stream.write(json.dumps(record))
+    separator = ',\n'
+
+  stream.write('[]\n' if separator == '[' else ']\n')
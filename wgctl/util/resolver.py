@@ -0,0 +1,359 @@
+import marshal
+import os
+import secrets
+import socket
+import struct
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from socket import AF_INET, AF_INET6, inet_ntop, inet_pton
+from wgctl.util.files import replace_file, private_directory
+from wgctl.util.network import parse_endpoint
+
+HOSTS_PATH = os.environ.get('WGCTL_HOSTS', '/etc/hosts')
+RESOLV_CONF = '/etc/resolv.conf'
+CACHE_VERSION = 1
+
+DNS_HEADER = struct.Struct('!HHHHHH')
+DNS_RECORD = struct.Struct('!HHIH')
+DNS_PORT = 53
+DNS_FLAG_QR = 0x8000
+DNS_FLAG_RD = 0x0100
+DNS_FLAG_TC = 0x0200
+
+QTYPES = ((1, AF_INET), (28, AF_INET6))
+
+# Answers obtained without a TTL, through getaddrinfo(), are kept this long
+DEFAULT_TTL = 300
+
+class ResolveError(Exception):
+  pass
+
+class Resolver(object):
+  """
+  Resolves hostnames to a single address, from a hosts file first, then
+  through a DNS server queried directly (so that answers come with their
+  TTL), and from getaddrinfo() if that fails. DNS answers are cached until
+  their TTL expires, in a file that outlives the process when cache_path is
+  given.
+
+  The hosts file and DNS server default to those of the system, and can be
+  set with $WGCTL_HOSTS and $WGCTL_NAMESERVER (address or address:port).
+  """
+
+  def __init__(self, cache_path=None, hosts_path=HOSTS_PATH, nameserver=None, jobs=32, timeout=2.0):
+    self.cache_path = cache_path
+    self.hosts = read_hosts(hosts_path) if hosts_path is not None else {}
+    self.nameserver = split_nameserver(nameserver or os.environ.get('WGCTL_NAMESERVER') or system_nameserver())
+    self.jobs = jobs
+    self.timeout = timeout
+    self.lock = threading.Lock()
+    self.cache = self.load_cache()
+    self.queries = 0
+
+  def resolve(self, hosts, now=None):
+    """
+    Resolves hosts concurrently, on a pool of at most jobs threads, skipping
+    those with an unexpired cached answer. Returns a dict of host to
+    (family, address), and a dict of host to the reason it failed.
+    """
+
+    now = now if now is not None else time.time()
+    answers, failures, missing = {}, {}, []
+
+    for host in set(hosts):
+      answer = self.hosts.get(host.lower().rstrip('.'))
+      cached = self.cache.get(host)
+
+      if answer is not None:
+        answers[host] = answer
+      elif cached is not None and cached[2] > now:
+        answers[host] = cached[:2]
+      else:
+        missing.append(host)
+
+    def lookup(host):
+      try:
+        return host, self.lookup(host), None
+      except (OSError, ResolveError) as e:
+        return host, None, str(e) or type(e).__name__
+
+    if len(missing) > 0:
+      with ThreadPoolExecutor(max_workers=max(1, min(self.jobs, len(missing)))) as pool:
+        for host, answer, failure in pool.map(lookup, missing):
+          if answer is None:
+            failures[host] = failure
+            continue
+
+          family, address, ttl = answer
+          answers[host] = (family, address)
+          self.cache[host] = (int(family), address, now + ttl)
+
+      self.save_cache(now)
+
+    return answers, failures
+
+  def lookup(self, host):
+    """
+    Returns the (family, address, ttl) of host, preferring IPv4
+    """
+
+    if self.nameserver is not None:
+      try:
+        for qtype, family in QTYPES:
+          answer = self.query(host, qtype, family)
+          if answer is not None:
+            return answer
+      except (OSError, ResolveError):
+        pass
+
+    try:
+      family, _, _, _, address = socket.getaddrinfo(host, None, type=socket.SOCK_DGRAM)[0]
+    except socket.gaierror as e:
+      raise ResolveError(e.strerror)
+
+    return family, address[0], DEFAULT_TTL
+
+  def query(self, host, qtype, family):
+    """
+    Asks the DNS server for the records of the given type, and returns the
+    first address of the answer with the lowest TTL of its records (CNAMEs
+    included), or None if there is none. Raises ResolveError if the server
+    cannot answer.
+    """
+
+    address, port = self.nameserver
+    ident = secrets.randbits(16)
+    question = b''.join(bytes([len(label)]) + label.encode('idna') for label in host.rstrip('.').split('.')) + b'\0'
+    question += struct.pack('!HH', qtype, 1)
+    request = DNS_HEADER.pack(ident, DNS_FLAG_RD, 1, 0, 0, 0) + question
+
+    with socket.socket(AF_INET6 if ':' in address else AF_INET, socket.SOCK_DGRAM) as sock:
+      sock.settimeout(self.timeout)
+      sock.connect((address, port))
+
+      with self.lock:
+        self.queries += 1
+
+      for _ in range(2):
+        sock.send(request)
+
+        try:
+          while True:
+            reply = sock.recv(4096)
+            if is_reply(reply, ident, question):
+              break
+        except socket.timeout:
+          continue
+
+        return parse_reply(reply, qtype, family)
+
+    raise ResolveError('no answer from {}'.format(address))
+
+  def load_cache(self):
+    if self.cache_path is None:
+      return {}
+
+    try:
+      with open(self.cache_path, 'rb') as stream:
+        version, cache = marshal.load(stream)
+    except (OSError, EOFError, ValueError, TypeError):
+      return {}
+
+    return cache if version == CACHE_VERSION else {}
+
+  def save_cache(self, now):
+    """
+    Writes the unexpired answers to the cache file. Failures are ignored, as
+    for the configuration cache.
+    """
+
+    if self.cache_path is None:
+      return
+
+    cache = {host: answer for host, answer in self.cache.items() if answer[2] > now}
+
+    try:
+      private_directory(os.path.dirname(self.cache_path))
+      replace_file(self.cache_path, marshal.dumps((CACHE_VERSION, cache)))
+    except (OSError, ValueError):
+      pass
+
+def is_reply(reply, ident, question):
+  """
+  Returns True if reply answers the query with the given id and question
+  section. Anything else is ignored, as it may be spoofed or late.
+  """
+
+  if len(reply) < DNS_HEADER.size + len(question):
+    return False
+
+  reply_ident, flags, questions, _, _, _ = DNS_HEADER.unpack_from(reply)
+  echoed = reply[DNS_HEADER.size:DNS_HEADER.size + len(question)]
+
+  return reply_ident == ident and flags & DNS_FLAG_QR != 0 and questions == 1 and echoed.lower() == question.lower()
+
+def parse_reply(reply, qtype, family):
+  """
+  Returns the (family, address, ttl) of the first record of type qtype in a
+  DNS reply, or None if there is none. Raises ResolveError if the reply is an
+  error or is malformed.
+  """
+
+  if len(reply) < DNS_HEADER.size:
+    raise ResolveError('malformed DNS answer')
+
+  _, flags, questions, answers, _, _ = DNS_HEADER.unpack_from(reply)
+  code = flags & 0xf
+
+  if flags & DNS_FLAG_TC:
+    raise ResolveError('truncated DNS answer')
+  if code == 3:
+    return None
+  if code != 0:
+    raise ResolveError('DNS error {}'.format(code))
+
+  offset = DNS_HEADER.size
+  for _ in range(questions):
+    offset = skip_name(reply, offset) + 4
+
+  address, ttl = None, None
+
+  for _ in range(answers):
+    offset = skip_name(reply, offset)
+    if offset + DNS_RECORD.size > len(reply):
+      raise ResolveError('malformed DNS answer')
+
+    kind, _, record_ttl, length = DNS_RECORD.unpack_from(reply, offset)
+    offset += DNS_RECORD.size
+
+    if offset + length > len(reply):
+      raise ResolveError('malformed DNS answer')
+
+    ttl = record_ttl if ttl is None else min(ttl, record_ttl)
+    if kind == qtype and address is None:
+      if length != (4 if family == AF_INET else 16):
+        raise ResolveError('malformed DNS answer')
+
+      address = inet_ntop(family, reply[offset:offset + length])
+
+    offset += length
+
+  if address is None:
+    return None
+
+  return family, address, ttl
+
+def skip_name(data, offset):
+  while offset < len(data):
+    length = data[offset]
+
+    if length == 0:
+      return offset + 1
+    if length & 0xc0 == 0xc0:
+      return offset + 2
+
+    offset += length + 1
+
+  raise ResolveError('malformed DNS answer')
+
+def read_hosts(hosts_path):
+  """
+  Returns the first address of every name in a hosts file
+  """
+
+  hosts = {}
+
+  try:
+    with open(hosts_path) as stream:
+      for line in stream:
+        fields = line.split('#', 1)[0].split()
+        if len(fields) < 2:
+          continue
+
+        family = AF_INET6 if ':' in fields[0] else AF_INET
+        address = fields[0].split('%')[0]
+
+        try:
+          inet_pton(family, address)
+        except OSError:
+          continue
+
+        for name in fields[1:]:
+          hosts.setdefault(name.lower(), (family, address))
+  except OSError:
+    pass
+
+  return hosts
+
+def split_nameserver(nameserver):
+  """
+  Returns the (address, port) of a nameserver given as address, address:port
+  or [address]:port, or None
+  """
+
+  if nameserver is None:
+    return None
+  if nameserver.startswith('['):
+    address, _, port = nameserver[1:].partition(']')
+    return address, int(port.lstrip(':') or DNS_PORT)
+  if nameserver.count(':') == 1:
+    address, _, port = nameserver.partition(':')
+    return address, int(port)
+
+  return nameserver, DNS_PORT
+
+def system_nameserver():
+  try:
+    with open(RESOLV_CONF) as stream:
+      for line in stream:
+        fields = line.split()
+        if len(fields) >= 2 and fields[0] == 'nameserver':
+          return fields[1]
+  except OSError:
+    pass
+
+  return None
+
+def resolve_endpoints(config, resolver=None):
+  """
+  Returns config with the hostnames of its peer endpoints replaced by their
+  addresses, resolved all at once (by default with answers cached next to
+  the parsed configurations). Aborts if any of them cannot be resolved.
+  """
+
+  from wgctl.util import config as configuration
+  from wgctl.util.cli import error, fatal
+  from wgctl.util.model import Tunnel
+
+  endpoints = {}
+
+  for peer in config.peers:
+    if peer.endpoint is not None:
+      family, host, port = parse_endpoint(peer.endpoint)
+      if family is None:
+        endpoints[peer.endpoint] = (host, port)
+
+  if len(endpoints) == 0:
+    return config
+
+  if resolver is None:
+    resolver = Resolver(cache_path=os.path.join(configuration.CACHE_DIR, 'endpoints.cache'))
+
+  answers, failures = resolver.resolve(host for host, _ in endpoints.values())
+
+  if len(failures) > 0:
+    for host, failure in sorted(failures.items()):
+      error('could not resolve {}'.format(host), failure)
+
+    fatal('could not resolve {} endpoints'.format(len(failures)))
+
+  resolved = {}
+  for endpoint, (host, port) in endpoints.items():
+    family, address = answers[host]
+    resolved[endpoint] = '[{}]:{}'.format(address, port) if family == AF_INET6 else '{}:{}'.format(address, port)
+
+  peers = [peer.replace(endpoint=resolved[peer.endpoint]) if peer.endpoint in resolved else peer for peer in config.peers]
+
+  return Tunnel(config.interface, peers, config.description)
@@ -0,0 +1,141 @@
+from socket import AF_INET, AF_INET6
+from ipaddress import ip_network
+
+from pyroute2 import IPBatch
+from pyroute2.netlink import NLMSG_ERROR
+
+DEFAULT_ROUTE = '0.0.0.0/0'
+
+RT_TABLE_MAIN = 254
+
+# Routes installed by wgctl carry this protocol, unassigned in iproute2's
+# rt_protos, so that they can be told apart from those added by hooks or by
+# hand
+RTPROT_WGCTL = 119
+
+RTNL_BATCH_SIZE = 32768
+RTNL_RECV_BUFSIZE = 65536
+
+def normalize(net):
+  return str(ip_network(net, strict=False))
+
+def tunnel_routes(config):
+  """
+  Returns the set of prefixes routed through the tunnel interface, and whether
+  the tunnel carries the default route (which lives in its own table).
+  """
+
+  routes, default = set(), False
+
+  for peer in config.peers:
+    for aip in peer.allowed_ips:
+      net = normalize(aip)
+
+      if net == DEFAULT_ROUTE:
+        default = True
+      else:
+        routes.add(net)
+
+  return routes, default
+
+def live_routes(ip, index):
+  """
+  Returns the set of prefixes currently routed through the given interface in
+  the main table by wgctl, leaving out the ones the kernel, hooks or anyone
+  else installed.
+  """
+
+  routes = set()
+
+  for family in (AF_INET, AF_INET6):
+    for route in ip.get_routes(family=family, table=RT_TABLE_MAIN, oif=index):
+      dst = route.get_attr('RTA_DST')
+      if route['proto'] != RTPROT_WGCTL or dst is None:
+        continue
+
+      routes.add('{}/{}'.format(dst, route['dst_len']))
+
+  return routes
+
+def has_default(ip, index, port):
+  routes = ip.get_routes(family=AF_INET, table=port, oif=index)
+
+  return any(route['dst_len'] == 0 for route in routes)
+
+def add_route(ip, index, net):
+  ip.route('add', dst=net, oif=index, proto=RTPROT_WGCTL)
+
+def delete_route(ip, index, net):
+  ip.route('delete', dst=net, oif=index, proto=RTPROT_WGCTL)
+
+def add_default(ip, index, port):
+  ip.route('add', dst=DEFAULT_ROUTE, oif=index, table=port)
+  ip.rule('add', table=RT_TABLE_MAIN, FRA_SUPPRESS_PREFIXLEN=0, priority=18000)
+  ip.rule('add', fwmark=port, fwmask=0, table=port, priority=20000)
+
+def delete_default(ip, index, port):
+  ip.route('delete', dst=DEFAULT_ROUTE, oif=index, table=port)
+  delete_default_rules(ip, port)
+
+def delete_default_rules(ip, port):
+  ip.rule('delete', table=RT_TABLE_MAIN, FRA_SUPPRESS_PREFIXLEN=0, priority=18000)
+  ip.rule('delete', fwmark=port, fwmask=0, table=port, priority=20000)
+
+class RouteBatch(object):
+  """
+  Collects route and rule changes with the same interface as IPRoute, and
+  sends them as pipelined rtnetlink messages on commit(). Acknowledgements are
+  read back afterwards, so one failing change does not stop the others.
+  """
+
+  def __init__(self):
+    self.batch = IPBatch()
+    self.changes = []
+
+  def route(self, command, **kwarg):
+    self.batch.route(command, **kwarg)
+    self.changes.append(('{} route {}'.format(command, kwarg.get('dst')), len(self.batch.batch)))
+
+  def rule(self, command, **kwarg):
+    self.batch.rule(command, **kwarg)
+    self.changes.append(('{} rule {}'.format(command, kwarg.get('priority')), len(self.batch.batch)))
+
+  def commit(self, ip, ignore=()):
+    """
+    Sends all collected changes through ip, in windows of RTNL_BATCH_SIZE
+    bytes so that neither socket buffer overflows, and returns the
+    (change, error) pairs for every change the kernel refused. Errors whose
+    code is listed in ignore are left out.
+    """
+
+    failures = []
+    data = bytes(self.batch.batch)
+    start, index = 0, 0
+
+    while index < len(self.changes):
+      end = index + 1
+      while end < len(self.changes) and self.changes[end][1] - start <= RTNL_BATCH_SIZE:
+        end += 1
+
+      ip.sendto(data[start:self.changes[end - 1][1]], (0, 0))
+
+      for (change, _), error in zip(self.changes[index:end], self.acks(ip, end - index)):
+        if error is not None and error.code not in ignore:
+          failures.append((change, error))
+
+      start, index = self.changes[end - 1][1], end
+
+    self.batch.reset()
+    self.changes = []
+
+    return failures
+
+  def acks(self, ip, count):
+    while count > 0:
+      for msg in ip.marshal.parse(ip.recv(RTNL_RECV_BUFSIZE)):
+        if msg['header']['type'] != NLMSG_ERROR:
+          continue
+
+        yield msg['header']['error']
+
+        count -= 1
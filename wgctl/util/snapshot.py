@@ -0,0 +1,116 @@
+import heapq
+import operator
+import time
+
+from array import array
+from itertools import compress
+from wgctl.util.decoder import decode_counters
+from wgctl.util.netlink import WG_KEY_LEN, WG_CMD_GET_DEVICE
+
+class Snapshot(object):
+  """
+  Traffic counters and handshake times of every peer of a tunnel, held as
+  columns: keys is a table of concatenated raw public keys, and rx, tx and
+  handshake are arrays indexed like it. Rankings, thresholds and deltas work
+  on whole columns, so that they stay cheap with hundreds of thousands of
+  peers.
+  """
+
+  __slots__ = ('interface', 'time', 'keys', 'rx', 'tx', 'handshake', '_index')
+
+  def __init__(self, interface, keys=None, rx=None, tx=None, handshake=None, when=None):
+    self.interface = interface
+    self.time = when if when is not None else time.monotonic()
+    self.keys = keys if keys is not None else bytearray()
+    self.rx = rx if rx is not None else array('Q')
+    self.tx = tx if tx is not None else array('Q')
+    self.handshake = handshake if handshake is not None else array('q')
+    self._index = None
+
+  @classmethod
+  def capture(cls, wg, ifname):
+    snapshot = cls(ifname)
+    msg = wg.device_msg(ifname=ifname, cmd=WG_CMD_GET_DEVICE)
+
+    decode_counters(wg.dump(msg), wg.prid, snapshot.keys, snapshot.rx, snapshot.tx, snapshot.handshake)
+    snapshot.time = time.monotonic()
+
+    return snapshot
+
+  def __len__(self):
+    return len(self.rx)
+
+  def key(self, position):
+    return bytes(self.keys[position * WG_KEY_LEN:(position + 1) * WG_KEY_LEN])
+
+  def position(self, key):
+    """
+    Returns the position of the peer with the given raw public key, or None
+    """
+
+    if self._index is None:
+      size = WG_KEY_LEN
+      self._index = {bytes(self.keys[i:i + size]): i // size for i in range(0, len(self.keys), size)}
+
+    return self._index.get(bytes(key))
+
+  def total(self):
+    return array('Q', map(operator.add, self.rx, self.tx))
+
+  def top(self, column, count=None, reverse=True, positions=None):
+    """
+    Returns the positions of the count peers (among the given positions, or
+    all of them) with the highest or lowest values in column, best first
+    """
+
+    if positions is None:
+      positions = range(len(column))
+
+    if count is None:
+      return sorted(positions, key=column.__getitem__, reverse=reverse)
+    elif reverse:
+      return heapq.nlargest(count, positions, key=column.__getitem__)
+
+    return heapq.nsmallest(count, positions, key=column.__getitem__)
+
+  def where(self, column, predicate):
+    """
+    Returns the positions of the peers whose value in column satisfies
+    predicate, such as (3600).__lt__
+    """
+
+    return list(compress(range(len(column)), map(predicate, column)))
+
+  def stale(self, seconds, now=None):
+    """
+    Returns the positions of the peers without a handshake in the last given
+    seconds (including those that never had one)
+    """
+
+    if now is None:
+      now = time.time()
+
+    return self.where(self.handshake, (now - seconds).__gt__)
+
+  def delta(self, previous):
+    """
+    Returns the bytes received and sent by every peer since the previous
+    snapshot, and the seconds elapsed between both. Peers that were not in
+    the previous snapshot, or whose counters went backwards (as when a peer
+    is removed and added again) count from zero.
+    """
+
+    if previous.keys == self.keys:
+      rx_before, tx_before = previous.rx, previous.tx
+    else:
+      positions = [previous.position(self.keys[i:i + WG_KEY_LEN]) for i in range(0, len(self.keys), WG_KEY_LEN)]
+      rx_before = array('Q', (0 if p is None else previous.rx[p] for p in positions))
+      tx_before = array('Q', (0 if p is None else previous.tx[p] for p in positions))
+
+    rx = array('Q', map(difference, self.rx, rx_before))
+    tx = array('Q', map(difference, self.tx, tx_before))
+
+    return rx, tx, self.time - previous.time
+
+def difference(after, before):
+  return after - before if after >= before else after
@@ -0,0 +1,209 @@
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+from wgctl.util.cli import format_size
+
+NLMSG_HEADER = struct.Struct('IHHI')
+NLMSG_ERROR = 2
+NLM_F_ACK = 4
+
+# The running Tracer, set by `wgctl --trace-timings`. While it is None, phase()
+# returns a shared no-op context manager and sockets are left untouched, so
+# that tracing costs a global lookup when it is off.
+active = None
+
+class Untraced(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    return False
+
+UNTRACED = Untraced()
+
+def phase(name):
+  """
+  Returns a context manager recording the wall time of the code it wraps
+  under name, when tracing
+  """
+
+  if active is None:
+    return UNTRACED
+
+  return Phase(active, name)
+
+def instrument(sock):
+  """
+  Counts the netlink messages and bytes going through a pyroute2 socket,
+  and the time the kernel takes to acknowledge requests, when tracing.
+  Returns the socket.
+  """
+
+  if active is not None:
+    active.instrument(sock)
+
+  return sock
+
+def start():
+  global active
+
+  active = Tracer()
+
+  return active
+
+class Phase(object):
+  __slots__ = ('tracer', 'name', 'start')
+
+  def __init__(self, tracer, name):
+    self.tracer = tracer
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *args):
+    self.tracer.record(self.name, self.start, time.perf_counter())
+    return False
+
+class Tracer(object):
+  def __init__(self):
+    self.origin = time.perf_counter()
+    self.lock = threading.Lock()
+    self.phases = []
+    self.acks = []
+    self.pending = {}
+    self.sent_messages = self.sent_bytes = 0
+    self.received_messages = self.received_bytes = 0
+
+  def record(self, name, start, end):
+    with self.lock:
+      self.phases.append((name, threading.get_ident(), start, end))
+
+  def instrument(self, sock):
+    sendto, gate, recv, recv_ft = sock.sendto, sock.sendto_gate, sock.recv, sock.recv_ft
+
+    def traced_sendto(data, *args, **kwargs):
+      self.sent(data)
+      return sendto(data, *args, **kwargs)
+
+    def traced_gate(msg, addr):
+      result = gate(msg, addr)
+      self.sent(msg.data)
+      return result
+
+    def traced_recv(*args, **kwargs):
+      data = recv(*args, **kwargs)
+      self.received(data)
+      return data
+
+    def traced_recv_ft(*args, **kwargs):
+      data = recv_ft(*args, **kwargs)
+      self.received(data)
+      return data
+
+    sock.sendto = traced_sendto
+    sock.sendto_gate = traced_gate
+    sock.recv = traced_recv
+    sock.recv_ft = traced_recv_ft
+
+  def sent(self, data):
+    now = time.perf_counter()
+
+    with self.lock:
+      self.sent_bytes += len(data)
+
+      for _, flags, seq in messages(data):
+        self.sent_messages += 1
+        if flags & NLM_F_ACK:
+          self.pending.setdefault(seq, now)
+
+  def received(self, data):
+    now = time.perf_counter()
+
+    with self.lock:
+      self.received_bytes += len(data)
+
+      for kind, _, seq in messages(data):
+        self.received_messages += 1
+        if kind == NLMSG_ERROR and seq in self.pending:
+          self.acks.append(now - self.pending.pop(seq))
+
+  def summary(self, stream):
+    """
+    Writes the total wall time and number of runs of every phase, in the
+    order they first started, followed by the netlink traffic
+    """
+
+    totals = {}
+    for name, _, start, end in self.phases:
+      calls, seconds = totals.get(name, (0, 0))
+      totals[name] = (calls + 1, seconds + end - start)
+
+    print('{:<32} {:>6} {:>10}'.format('phase', 'calls', 'ms'), file=stream)
+    for name, (calls, seconds) in totals.items():
+      print('{:<32} {:>6} {:>10.2f}'.format(name, calls, seconds * 1000), file=stream)
+
+    print('netlink: {} messages ({}) sent, {} messages ({}) received'.format(
+      self.sent_messages, format_size(self.sent_bytes), self.received_messages, format_size(self.received_bytes)), file=stream)
+
+    if len(self.acks) > 0:
+      acks = sorted(self.acks)
+      print('acks: {}, latency {:.3f} ms median, {:.3f} ms max'.format(
+        len(acks), acks[len(acks) // 2] * 1000, acks[-1] * 1000), file=stream)
+
+  def events(self):
+    """
+    Returns the phases as complete events of the Trace Event Format (as read
+    by chrome://tracing or Perfetto), followed by the netlink counters
+    """
+
+    pid = os.getpid()
+    end = time.perf_counter()
+    events = [{
+      'name': name, 'cat': 'phase', 'ph': 'X', 'pid': pid, 'tid': tid,
+      'ts': round((start - self.origin) * 1e6, 1), 'dur': round((stop - start) * 1e6, 1)
+    } for name, tid, start, stop in self.phases]
+
+    events.append({
+      'name': 'netlink', 'ph': 'C', 'pid': pid, 'ts': round((end - self.origin) * 1e6, 1),
+      'args': {
+        'sent_messages': self.sent_messages, 'sent_bytes': self.sent_bytes,
+        'received_messages': self.received_messages, 'received_bytes': self.received_bytes,
+        'acks': len(self.acks), 'ack_latency_us': sum(self.acks) * 1e6 / max(len(self.acks), 1)
+      }
+    })
+
+    return events
+
+  def report(self, format, stream=None):
+    stream = stream or sys.stderr
+
+    if format == 'json':
+      json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms'}, stream)
+      stream.write('\n')
+    else:
+      self.summary(stream)
+
+def messages(data):
+  """
+  Yields the type, flags and sequence number of every netlink message in a
+  buffer
+  """
+
+  offset = 0
+
+  while offset + NLMSG_HEADER.size <= len(data):
+    length, kind, flags, seq = NLMSG_HEADER.unpack_from(data, offset)
+    if length < NLMSG_HEADER.size:
+      break
+
+    yield kind, flags, seq
+
+    offset += (length + 3) & ~3